@@ -1,6 +1,9 @@
 import sys, os, json, csv
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "canadian_user_identification"))
+from tweet_reader import read_tweets
+
 parser = argparse.ArgumentParser(description="Converts a tweet dataset of jsonl objects to a dataset (with the same structure) containing only tweet IDs.")
 parser.add_argument("src", help="Path to the input directory containing folders of tweet files", type=str)
 parser.add_argument("dest", help="Path to the destination directory where the output should be stored", type=str)
@@ -11,19 +14,12 @@ def extract_tweet_ids(fpath):
     Reads all tweets in a file and returns a list of their IDs, in order.
     """
     tweets = []
-    with open(fpath, "r") as json_file:
-        line = json_file.readline()
-        i = 0
-
-        while line:
-            if i and i % PRINT_VAL == 0:
-                print(f"    {i}")
-            d = json.loads(line)
-            tweets.append(d["id"])
-            
-            # read the next line
-            line = json_file.readline()
-            i += 1
+    i = 0
+    for d in read_tweets(fpath, fields=["id"]):
+        if i and i % PRINT_VAL == 0:
+            print(f"    {i}")
+        tweets.append(d["id"])
+        i += 1
 
     return tweets
 
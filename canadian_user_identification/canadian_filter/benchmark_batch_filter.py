@@ -0,0 +1,55 @@
+# Checks that CanadianFilter.is_canadian_batch gives the same result as
+# is_canadian for every tweet, and compares their running times, on snapshots
+# of the tweets in a folder (by default, the bundled canadian_tweets_2020-10-01
+# sample), built in memory.
+# Run from the canadian_filter directory.
+import argparse
+import os
+import time
+
+from canadian_filter import CanadianFilter, read_tweets
+from profile_snapshot import SNAPSHOT_FIELDS, build_snapshot, unpack_snapshot, snapshot_tweets
+
+parser = argparse.ArgumentParser(description="Compares is_canadian_batch with is_canadian on snapshots of tweet files.")
+
+parser.add_argument("input_path",
+                    help="The input folder containing .jsonl files",
+                    type = str, nargs="?", default="canadian_tweets_2020-10-01")
+parser.add_argument("--repeat",
+                    help="The number of times the tweets are filtered; the best time is reported",
+                    type = int, default=5)
+
+
+def best_time(function, tables, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        results = [function(table) for table in tables]
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    cf = CanadianFilter()
+
+    tables = []
+    for f in sorted(os.listdir(args.input_path)):
+        tweets = read_tweets(os.path.join(args.input_path, f), fields=SNAPSHOT_FIELDS)
+        tables.append(unpack_snapshot(build_snapshot(tweets)))
+    num_tweets = sum(len(table["id"]) for table in tables)
+
+    # the per-tweet path on the same tables, building each tweet's dict
+    per_tweet = lambda table: [cf.is_canadian(d) for d in snapshot_tweets(table)]
+    # fill the reverse geocoding cache first, so that both are timed with it
+    per_tweet_time, expected = best_time(per_tweet, tables, 1)
+    per_tweet_time, expected = best_time(per_tweet, tables, args.repeat)
+    batch_time, batch_results = best_time(cf.is_canadian_batch, tables, args.repeat)
+
+    mismatches = sum(1 for table_expected, results in zip(expected, batch_results)
+                     for i, result in enumerate(table_expected) if results.result(i) != result)
+    print("%d tweets in %d files" % (num_tweets, len(tables)))
+    print("is_canadian: %.2fus/tweet  is_canadian_batch: %.2fus/tweet  speedup: %.1fx  mismatches: %d"
+          % (per_tweet_time / num_tweets * 1e6, batch_time / num_tweets * 1e6,
+             per_tweet_time / max(batch_time, 1e-9), mismatches))
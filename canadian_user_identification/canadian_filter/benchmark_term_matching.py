@@ -0,0 +1,130 @@
+# Compares the loops CanadianFilter uses to find the location terms and demonyms
+# in a user's profile (one substring search per term) with regular expressions
+# over all the terms, on the user profiles of the tweets in a folder (by
+# default, the bundled canadian_tweets_2020-10-01 sample).
+#
+# Each regular expression is used as a gate: the profiles it matches are then
+# searched with the loop, to find the same evidence, and the others are
+# skipped. Two regular expressions are compared: a plain alternation of the
+# terms, and the trie of the terms (so that at each position of the text, only
+# the terms starting with the next characters are tried).
+# Run from the canadian_filter directory.
+import argparse
+import os
+import re
+import time
+
+from canadian_filter import CanadianFilter, read_tweets
+
+parser = argparse.ArgumentParser(description="Compares the term loops of CanadianFilter with regular expressions over the terms.")
+
+parser.add_argument("input_path",
+                    help="The input folder containing .jsonl files",
+                    type = str, nargs="?", default="canadian_tweets_2020-10-01")
+parser.add_argument("--repeat",
+                    help="The number of times the profiles are matched; the best time is reported",
+                    type = int, default=20)
+
+
+def alternation_pattern(terms):
+    """
+    Returns a regular expression matching any of the terms, the longest
+    ones first.
+    """
+    return "|".join(re.escape(term) for term in sorted(terms, key=lambda t: (-len(t), t)))
+
+
+def trie_pattern(terms):
+    """
+    Returns a regular expression matching the longest of the terms that the
+    text starts with, built from the trie of the terms.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for c in term:
+            node = node.setdefault(c, {})
+        node[""] = True
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    branches = [re.escape(c) + _node_pattern(child) for c, child in sorted(node.items()) if c]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        # a term ends here, but prefer the longer terms
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+def regex_gate(pattern, loop):
+    """
+    Returns a function giving the same evidence as loop, which only calls
+    loop on the texts that pattern matches.
+    """
+    search = re.compile(pattern).search
+
+    def find(text):
+        if search(text) is None:
+            return None
+        return loop(text)
+    return find
+
+
+def time_calls(function, texts, repeat):
+    # the best time of repeat runs, so that other processes matter less
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        results = [function(text) for text in texts]
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    cf = CanadianFilter()
+
+    locations = []
+    descriptions = []
+    for f in sorted(os.listdir(args.input_path)):
+        for d in read_tweets(os.path.join(args.input_path, f), fields=["user"]):
+            locations.append(d["user"]["location"].lower())
+            descriptions.append(d["user"]["description"].lower())
+    print("%d profiles, %d location terms, %d demonyms"
+          % (len(locations), len(cf.canadian_locs), len(cf.canadian_demonyms)))
+
+    # the time per profile of matching both fields of all the profiles
+    totals = {}
+    for name, texts, loop, terms in [
+            ("location", locations, cf.location_term, cf.canadian_locs),
+            ("description", descriptions, cf.description_demonym, cf.canadian_demonyms)]:
+        matchers = [("alternation regex", regex_gate(alternation_pattern(terms), loop)),
+                    ("trie regex", regex_gate(trie_pattern(terms), loop))]
+        _, expected = time_calls(loop, texts, 1)
+        # most tweets of a general sample have no Canadian term, so these are timed apart
+        no_term = [text for text, e in zip(texts, expected) if e is None]
+        for subset, subset_texts in [("all", texts), ("without a term", no_term)]:
+            if not subset_texts:
+                continue
+            loop_time, subset_expected = time_calls(loop, subset_texts, args.repeat)
+            if subset == "all":
+                totals["loops"] = totals.get("loops", 0) + loop_time / len(texts)
+            print("%s, %s (%d): loops: %.2fus"
+                  % (name, subset, len(subset_texts), loop_time / len(subset_texts) * 1e6))
+            for matcher_name, matcher in matchers:
+                matcher_time, found = time_calls(matcher, subset_texts, args.repeat)
+                mismatches = sum(1 for a, b in zip(subset_expected, found) if a != b)
+                if subset == "all":
+                    totals[matcher_name] = totals.get(matcher_name, 0) + matcher_time / len(texts)
+                print("    %s: %.2fus  speedup: %.1fx  mismatches: %d"
+                      % (matcher_name, matcher_time / len(subset_texts) * 1e6,
+                         loop_time / max(matcher_time, 1e-9), mismatches))
+
+    print("location and description, all (%d):" % len(locations))
+    for matcher_name, total in totals.items():
+        print("    %s: %.2fus  speedup: %.1fx"
+              % (matcher_name, total * 1e6, totals["loops"] / max(total, 1e-12)))
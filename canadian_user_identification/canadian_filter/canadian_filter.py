@@ -1,11 +1,20 @@
 # extract Canadian-looking user ids
 
 import argparse
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
+from collections import Counter, OrderedDict
 from copy import deepcopy
-import reverse_geocoder as rg
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tweet_reader import read_tweets
+from geocoding import get_geocoder, tweet_point, batches
+from profile_snapshot import SNAPSHOT_SUFFIX, read_snapshot
 
 # For printing status updates while running
 NUM_TWEETS = 10000
@@ -15,6 +24,53 @@ PROFILE_LOCATION = "user profile location"
 PROFILE_DESCRIPTION = "user profile description"
 COORDINATES = "coordinates"
 
+# The methods, in the order of the rules, as numbered in a BatchResult
+METHODS = [None, PLACE, COORDINATES, PROFILE_LOCATION, PROFILE_DESCRIPTION]
+
+# The tweet fields used by is_canadian
+FIELDS = ["id", "user", "place", "geo"]
+
+# The number of (user, profile) verdicts cached by cached_is_canadian
+PROFILE_CACHE_SIZE = 100000
+
+
+def profile_key(user_json):
+    """
+    Returns a hash of the location and description of a user.
+    """
+    return hash((user_json["location"], user_json["description"]))
+
+
+class BatchResult:
+    """
+    The results of CanadianFilter.is_canadian_batch on a table of tweets,
+    with one row per tweet:
+        is_canadian: True for the tweets found to be by a canadian (bool array)
+        method: the index in METHODS of the rule that decided, 0 if none (int8 array)
+        evidence, country_code: as in the result of is_canadian (object arrays)
+    result(i) builds the result dict is_canadian returns for tweet i.
+    """
+    def __init__(self, table, is_canadian, method, evidence, country_code):
+        self.table = table
+        self.is_canadian = is_canadian
+        self.method = method
+        self.evidence = evidence
+        self.country_code = country_code
+
+    def __len__(self):
+        return len(self.method)
+
+    def result(self, i):
+        method = METHODS[self.method[i]]
+        profile = self.table["profile"][i]
+        return {"is_canadian" : None if method is None else bool(self.is_canadian[i]),
+                "method" : method,
+                "evidence" : self.evidence[i],
+                "country_code" : self.country_code[i],
+                "description": self.table["descriptions"][profile].lower(),
+                "location" : self.table["locations"][profile].lower()
+                }
+
 
 class CanadianFilter:
     def __init__(self, locations_fname="canadian_location_terms.txt", demonyms_fname="canadian_demonyms.txt"):
@@ -23,6 +79,19 @@ class CanadianFilter:
             self.canadian_locs = set([i.lower() for i in f.read().split('\n') if len(i)])
         with open(demonyms_fname, "r") as f:
             self.canadian_demonyms = set([i.lower() for i in f.read().split('\n') if len(i)])
+        # reverse geocodes coordinates, with a cache
+        self.geocoder = get_geocoder()
+
+        # the verdicts on the profiles of users, see cached_is_canadian
+        self.profile_cache_size = PROFILE_CACHE_SIZE
+        self.profile_cache = OrderedDict()
+        # the number of tweets decided by each method (None if none applied)
+        self.method_counts = Counter()
+        # the number of tweets whose verdict was cached ("hit"), computed and
+        # cached ("miss"), computed because the tweet has a place object or
+        # coordinates ("geotagged"), or skipped because their user was
+        # already found to be Canadian ("known")
+        self.cache_counts = Counter()
 
     def is_canadian(self, tweet_json):
         """ Determines if the author of a tweet is Canadian by applying a
@@ -79,86 +148,421 @@ class CanadianFilter:
                 return result
 
         # 2. Check whether the tweet is geotagged with coordinates, and reverse geocode them.
-        if "geo" in tweet_json and tweet_json["geo"] != None:
-            geo = tweet_json["geo"]
-
-            if geo["type"] == "Point":
-                coords = tuple(geo["coordinates"])
-                location = rg.search(coords)[0]
-
-                if location["cc"] == "CA":
-                    # The tweet is geotagged in Canada, return True.
-                    result["country_code"] = location["cc"]
-                    result["is_canadian"] = True
-                    result["method"] = COORDINATES
-                    result["evidence"] = location["cc"]
-                    return result
-                else:
-                    # The tweet is geotagged outside of Canada, automatically return False.
-                    result["country_code"] = location["cc"]
-                    result["is_canadian"] = False
-                    result["method"] = COORDINATES
-                    result["evidence"] = location["cc"]
-                    return result
+        coords = tweet_point(tweet_json)
+        if coords is not None:
+            country_code = self.geocoder.country_code(coords)
 
-        # 3. Check whether the user's profile location contains a Canadian term.
-        for d in self.canadian_locs:
-            if d in loc:
-                # The user's location field contains a Canadian term, return True.
+            if country_code == "CA":
+                # The tweet is geotagged in Canada, return True.
+                result["country_code"] = country_code
                 result["is_canadian"] = True
-                result["method"] = PROFILE_LOCATION
-                result["evidence"] = d
+                result["method"] = COORDINATES
+                result["evidence"] = country_code
                 return result
+            else:
+                # The tweet is geotagged outside of Canada, automatically return False.
+                result["country_code"] = country_code
+                result["is_canadian"] = False
+                result["method"] = COORDINATES
+                result["evidence"] = country_code
+                return result
+
+        # 3. Check whether the user's profile location contains a Canadian term.
+        #    The evidence is the first such term in self.canadian_locs.
+        d = self.location_term(loc)
+        if d is not None:
+            # The user's location field contains a Canadian term, return True.
+            result["is_canadian"] = True
+            result["method"] = PROFILE_LOCATION
+            result["evidence"] = d
+            return result
 
         # 4. Check if the user's description contains a Canadian demonym such
-        #    as "Canadian" or "Albertan".
+        #    as "Canadian" or "Albertan". The evidence is the last such demonym
+        #    in self.canadian_demonyms.
+        d = self.description_demonym(desc)
+        if d is not None:
+            # The user's description contains a Canadian demonym, return True
+            result["is_canadian"] = True
+            result["method"] = PROFILE_DESCRIPTION
+            result["evidence"] = d
+
+        return result
+
+    def location_term(self, loc):
+        """
+        Returns the first term of self.canadian_locs in the lowercase profile
+        location loc, or None if there is none.
+        """
+        for d in self.canadian_locs:
+            if d in loc:
+                return d
+        return None
+
+    def description_demonym(self, desc):
+        """
+        Returns the last demonym of self.canadian_demonyms in the lowercase
+        profile description desc, or None if there is none.
+        """
+        evidence = None
         for d in self.canadian_demonyms:
             if d in desc:
-                # The user's description contains a Canadian demonym, return True
-                result["is_canadian"] = True
-                result["method"] = PROFILE_DESCRIPTION
-                result["evidence"] = d
-
+                evidence = d
+        return evidence
+
+    def cached_is_canadian(self, tweet_json):
+        """ Returns the same result as is_canadian, reusing the verdict on
+        an earlier tweet of the same user with the same profile location and
+        description. Tweets with a place object or coordinates are always
+        evaluated, as their verdict does not only depend on the profile.
+        A cached result is shared by the tweets it is returned for, so it
+        must not be modified.
+        """
+        if tweet_json["place"] is not None or tweet_point(tweet_json) is not None:
+            self.cache_counts["geotagged"] += 1
+            result = self.is_canadian(tweet_json)
+        else:
+            key = (tweet_json["user"]["id"], profile_key(tweet_json["user"]))
+            cache = self.profile_cache
+            if key in cache:
+                self.cache_counts["hit"] += 1
+                cache.move_to_end(key)
+                result = cache[key]
+            else:
+                self.cache_counts["miss"] += 1
+                result = self.is_canadian(tweet_json)
+                cache[key] = result
+                if len(cache) > self.profile_cache_size:
+                    cache.popitem(last=False)
+        self.method_counts[result["method"]] += 1
         return result
 
+    def is_canadian_batch(self, table):
+        """ Applies the rules of is_canadian to a table of tweets at once.
+        Each rule is applied to the tweets that the previous rules did not
+        decide: the place objects and coordinates with array operations and
+        one reverse geocoding search, and the profile rules once for each
+        distinct profile of these tweets.
+
+        Arguments:
+            table: the columns of a snapshot of tweets, as returned by
+                   profile_snapshot.read_snapshot
+
+        Returns:
+            results (BatchResult): the verdict, method and evidence of each tweet
+        """
+        n = len(table["id"])
+        is_canadian = np.zeros(n, dtype=bool)
+        method = np.zeros(n, dtype=np.int8)
+        evidence = np.full(n, None, dtype=object)
+        country_code = np.full(n, None, dtype=object)
+
+        # 1. The tweets geotagged with a place object.
+        rows = np.nonzero(table["has_country_code"])[0]
+        codes = table["country_code"][rows].astype(object)
+        is_canadian[rows] = codes == "CA"
+        method[rows] = METHODS.index(PLACE)
+        evidence[rows] = codes
+        country_code[rows] = codes
+
+        # 2. The other tweets geotagged with coordinates, reverse geocoded at once.
+        rows = np.nonzero((method == 0) & ~np.isnan(table["lat"]))[0]
+        if len(rows):
+            points = list(zip(table["lat"][rows].tolist(), table["lon"][rows].tolist()))
+            codes = np.array(self.geocoder.country_codes(points), dtype=object)
+            is_canadian[rows] = codes == "CA"
+            method[rows] = METHODS.index(COORDINATES)
+            evidence[rows] = codes
+            country_code[rows] = codes
+
+        # 3. The profile location of the other tweets, matched once per profile.
+        rows = np.nonzero(method == 0)[0]
+        profiles = table["profile"][rows]
+        found = np.full(len(table["locations"]), None, dtype=object)
+        for profile in np.unique(profiles).tolist():
+            found[profile] = self.location_term(table["locations"][profile].lower())
+        found = found[profiles]
+        matched = np.not_equal(found, None)
+        is_canadian[rows[matched]] = True
+        method[rows[matched]] = METHODS.index(PROFILE_LOCATION)
+        evidence[rows[matched]] = found[matched]
+
+        # 4. The profile description of the other tweets, matched once per profile.
+        rows = rows[~matched]
+        profiles = profiles[~matched]
+        found = np.full(len(table["descriptions"]), None, dtype=object)
+        for profile in np.unique(profiles).tolist():
+            found[profile] = self.description_demonym(table["descriptions"][profile].lower())
+        found = found[profiles]
+        matched = np.not_equal(found, None)
+        is_canadian[rows[matched]] = True
+        method[rows[matched]] = METHODS.index(PROFILE_DESCRIPTION)
+        evidence[rows[matched]] = found[matched]
+
+        return BatchResult(table, is_canadian, method, evidence, country_code)
+
+    def print_counts(self):
+        """
+        Prints the number of tweets decided by each method and the use of
+        the verdict cache so far.
+        """
+        print("    Tweets decided by each method: " +
+              ", ".join(f"{method or 'no method'}: {cnt}" for method, cnt in self.method_counts.most_common()))
+        print("    Verdicts: " +
+              ", ".join(f"{name}: {self.cache_counts[name]}" for name in ["hit", "miss", "geotagged", "known", "batch"]))
+
     def get_canadian_users(self, fpath):
         """
         Arguments:
-            fpath: path to .jsonl file to index
+            fpath: path to .jsonl file to index, or to its snapshot
 
         Returns:
             canadians: a set of all users found to be canadian
         """
-        canadians = set()
-        all_users = set()
-        with open(fpath, "r") as json_file:
-            print("Extracting Canadians from '{}'...".format(fpath))
-            line = json_file.readline()
-            i = 0 # count for printing status updates
+        return set(self.get_canadian_user_methods(fpath))
+
+    def get_canadian_user_methods(self, fpath):
+        """
+        Arguments:
+            fpath: path to .jsonl file to index, or to its snapshot (see
+                   profile_snapshot.py)
+
+        Returns:
+            canadians: a dict mapping the ID of each user found to be
+                       canadian to the method of the first tweet found to
+                       be by a canadian
+        """
+        if fpath.endswith(SNAPSHOT_SUFFIX):
+            return self.get_snapshot_canadian_user_methods(fpath)
 
-            while line:
-                d = json.loads(line)
+        canadians = {}
+        all_users = set()
+        print("Extracting Canadians from '{}'...".format(fpath))
+        i = 0 # count for printing status updates
+        for batch in batches(read_tweets(fpath, fields=FIELDS)):
+            # reverse geocode the coordinates of the whole batch at once, for
+            # the tweets without a place object
+            self.geocoder.prefetch([d for d in batch if d["place"] is None])
+            for d in batch:
                 userID = d["user"]["id"]
 
                 if i and i % NUM_TWEETS == 0:
                     # update the number of tweets processed so far
                     print(f"    {i}")
 
-                # apply the filter
-                result = self.is_canadian(d)
+                if str(userID) in canadians:
+                    # the user was already found to be Canadian
+                    self.cache_counts["known"] += 1
+                else:
+                    # apply the filter
+                    result = self.cached_is_canadian(d)
 
-                # add canadian users to the canadian set
-                if result["is_canadian"]:
-                    canadians.add(str(userID))
+                    # add canadian users to the canadian set
+                    if result["is_canadian"]:
+                        canadians[str(userID)] = result["method"]
 
                 # keep track of the total number of users
                 all_users.add(str(userID))
-                line = json_file.readline()
                 i += 1
 
         print(f"    Found {len(canadians)} Canadian users out of {len(all_users)} users")
+        self.print_counts()
+        return canadians
+
+    def get_snapshot_canadian_user_methods(self, fpath):
+        """
+        Returns the same canadian users and methods as
+        get_canadian_user_methods for a snapshot, applying the filter to
+        all its tweets at once with is_canadian_batch.
+        """
+        print("Extracting Canadians from '{}'...".format(fpath))
+        table = read_snapshot(fpath)
+        results = self.is_canadian_batch(table)
+
+        # the first tweet found to be by a canadian of each user, in order
+        rows = np.nonzero(results.is_canadian)[0]
+        _, first = np.unique(table["user_id"][rows], return_index=True)
+        first = np.sort(first)
+        canadians = {str(userID): METHODS[m] for userID, m in
+                     zip(table["user_id"][rows[first]].tolist(), results.method[rows[first]].tolist())}
+
+        self.cache_counts["batch"] += len(results)
+        methods, counts = np.unique(results.method, return_counts=True)
+        for m, cnt in zip(methods.tolist(), counts.tolist()):
+            self.method_counts[METHODS[m]] += cnt
+        print(f"    Found {len(canadians)} Canadian users out of {len(np.unique(table['user_id']))} users")
+        self.print_counts()
         return canadians
 
+
+def checkpoint_path(checkpoint_dir, fpath):
+    """
+    Returns the path of the checkpoint of an input file.
+    """
+    return os.path.join(checkpoint_dir, os.path.basename(fpath) + ".tsv")
+
+
+def terms_digest(locations_fname, demonyms_fname):
+    """
+    Returns a hash of the contents of the location term and demonym files.
+    """
+    digest = hashlib.sha256()
+    for fname in [locations_fname, demonyms_fname]:
+        with open(fname, "rb") as f:
+            data = f.read()
+        digest.update(str(len(data)).encode() + b"\n" + data)
+    return digest.hexdigest()
+
+
+def file_fingerprint(fpath, terms):
+    """
+    Returns the fingerprint of an input file stored in its checkpoint: the
+    digest of the term files (see terms_digest), and the size and
+    modification time of the input file. A checkpoint whose fingerprint
+    differs was written for other terms or another version of the input.
+    """
+    stat = os.stat(fpath)
+    return f"{terms} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def write_checkpoint(path, canadians, fingerprint):
+    """
+    Writes the canadian users of an input file and their methods to its
+    checkpoint, as USER_ID\tMETHOD lines after a "# FINGERPRINT" line. The
+    checkpoint only appears once it is complete, so that an interrupted run
+    never leaves a partial one.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"# {fingerprint}\n")
+        for userID, method in canadians.items():
+            f.write(f"{userID}\t{method}\n")
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint_fingerprint(path):
+    """
+    Returns the fingerprint of a checkpoint written by write_checkpoint, or
+    None if there is no checkpoint or it has no fingerprint.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        line = f.readline()
+    if not line.startswith("# "):
+        return None
+    return line[2:].rstrip("\n")
+
+
+def read_checkpoint(path):
+    """
+    Returns the dict of canadian users and methods written by write_checkpoint.
+    """
+    canadians = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            userID, method = line.rstrip("\n").split("\t")
+            canadians[userID] = method
+    return canadians
+
+
+# The filter of a worker process, created by init_worker
+_filter = None
+
+
+def init_worker(locations_fname, demonyms_fname):
+    """
+    Creates the CanadianFilter used by process_file in this process.
+    """
+    global _filter
+    _filter = CanadianFilter(locations_fname, demonyms_fname)
+
+
+def process_file(task):
+    """
+    Finds the canadian users of an input file and writes them to its
+    checkpoint. The task is a (fpath, checkpoint, fingerprint) tuple.
+    """
+    fpath, checkpoint, fingerprint = task
+    write_checkpoint(checkpoint, _filter.get_canadian_user_methods(fpath), fingerprint)
+    return fpath
+
+
+def filter_files(fpaths, checkpoint_dir, jobs=1,
+                 locations_fname="canadian_location_terms.txt", demonyms_fname="canadian_demonyms.txt"):
+    """
+    Finds the canadian users of each input file that does not have an up to
+    date checkpoint yet, writing them to its checkpoint, using a pool of
+    jobs processes if jobs > 1. A checkpoint is up to date if its
+    fingerprint (see file_fingerprint) matches the input file and the term
+    files.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    terms = terms_digest(locations_fname, demonyms_fname)
+    tasks = [(fpath, checkpoint_path(checkpoint_dir, fpath), file_fingerprint(fpath, terms)) for fpath in fpaths]
+    pending = []
+    stale = 0
+    for task in tasks:
+        fingerprint = read_checkpoint_fingerprint(task[1])
+        if fingerprint != task[2]:
+            pending.append(task)
+            stale += os.path.exists(task[1])
+    if len(pending) < len(tasks):
+        print(f"Resuming: {len(tasks) - len(pending)} of {len(tasks)} files are already done")
+    if stale:
+        print(f"Reprocessing {stale} files whose checkpoint is out of date")
+
+    if jobs > 1:
+        print(f"Processing {len(pending)} files with {jobs} processes")
+        with multiprocessing.Pool(jobs, initializer=init_worker,
+                                  initargs=(locations_fname, demonyms_fname)) as pool:
+            for _ in pool.imap_unordered(process_file, pending):
+                pass
+    elif pending:
+        init_worker(locations_fname, demonyms_fname)
+        for task in pending:
+            process_file(task)
+
+
+def merge_checkpoints(fpaths, checkpoint_dir, output_path):
+    """
+    Writes the canadian users of all the input files, without duplicates and
+    sorted by ID, to output_path, and prints the number of users found by
+    each method. A user found in several files counts for the method of the
+    first of these files.
+
+    Returns:
+        method_counts: the number of users found by each method
+    """
+    canadians = {}
+    for fpath in fpaths:
+        for userID, method in read_checkpoint(checkpoint_path(checkpoint_dir, fpath)).items():
+            canadians.setdefault(userID, method)
+
+    with open(output_path, "w") as out_file:
+        for userID in sorted(canadians, key=int):
+            out_file.write(userID + "\n")
+
+    method_counts = Counter(canadians.values())
+    print(f"Wrote {len(canadians)} Canadian users to {output_path}")
+    for method, cnt in method_counts.most_common():
+        print(f"    {method}: {cnt}")
+    return method_counts
+
+
+def remove_checkpoints(fpaths, checkpoint_dir):
+    """
+    Removes the checkpoints of the input files, and the checkpoint folder if
+    nothing else is left in it.
+    """
+    for fpath in fpaths:
+        os.remove(checkpoint_path(checkpoint_dir, fpath))
+    if not os.listdir(checkpoint_dir):
+        os.rmdir(checkpoint_dir)
+
+
 if __name__ == "__main__":
     # When run from the terminal, this program will extract the authors of all tweets
     # from the input sample that appear to be Canadian. The resulting IDs will be stored
@@ -166,32 +570,34 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Filter to extract users who seem Canadian based on their profile information")
 
     parser.add_argument("input_path",
-                        help="The input folder containing .jsonl files",
+                        help="The input folder containing .jsonl files or their snapshots (see profile_snapshot.py)",
                         type = str)
     parser.add_argument("output_path",
                         help="The file to which to write Canadian user IDs",
                         type = str)
+    parser.add_argument("--jobs",
+                        help="The number of input files processed in parallel",
+                        type = int, default=1)
+    parser.add_argument("--checkpoint-dir",
+                        help="The folder where the users found in each input file are saved, so that an interrupted run can be resumed (default: OUTPUT_PATH.checkpoints)",
+                        type = str, default=None)
+    parser.add_argument("--keep-checkpoints",
+                        help="Keep the checkpoints once the output is written",
+                        action="store_true")
 
     args = parser.parse_args()
 
-    cf = CanadianFilter()
-    out_file = open(args.output_path, "a")
-
-    canadians = set()
     if os.path.isdir(args.input_path):
-        for f in sorted(os.listdir(args.input_path)):
-            fpath = os.path.join(args.input_path, f)
-            new = cf.get_canadian_users(fpath)
-
-            # add all newly found canadians to the overall set
-            canadians = canadians.union(new)
+        fpaths = [os.path.join(args.input_path, f) for f in sorted(os.listdir(args.input_path))]
     else:
         # process a single file
-        canadians = cf.get_canadian_users(args.input_path)
+        fpaths = [args.input_path]
+    checkpoint_dir = args.checkpoint_dir or args.output_path + ".checkpoints"
 
-    # write all Canadian IDs to the output file
-    for c in canadians:
-        out_file.write(c+"\n")
+    filter_files(fpaths, checkpoint_dir, args.jobs)
 
-    out_file.close()
+    # write all Canadian IDs to the output file
+    merge_checkpoints(fpaths, checkpoint_dir, args.output_path)
+    if not args.keep_checkpoints:
+        remove_checkpoints(fpaths, checkpoint_dir)
     print("Done searching all provided files.")
@@ -0,0 +1,209 @@
+# Writes compact snapshots of the tweet fields CanadianFilter uses, so that the
+# filter can be run again (e.g., after changing the location terms) without
+# parsing the tweet JSON again.
+#
+# The snapshot of a tweet file is a NumPy .npz file with one row per tweet:
+#     id, user_id        the tweet and user IDs (int64)
+#     country_code       place.country_code, "" if the tweet has none
+#     has_country_code   True if the tweet has a place with a country code
+#     lat, lon           the coordinates of the geo Point, NaN if none
+#     profile            the index of the user's profile in the profiles below
+# and the distinct (user.location, user.description) profiles of the file, as
+# UTF-8 strings packed into one byte array with their offsets (see
+# pack_strings). Since users post many tweets with the same profile, each
+# profile is only stored once.
+#
+#     python3 profile_snapshot.py INPUT_PATH SNAPSHOT_PATH
+#     python3 canadian_filter.py SNAPSHOT_PATH OUTPUT_PATH
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tweet_reader import read_tweets
+
+# The file name suffix of snapshots
+SNAPSHOT_SUFFIX = ".npz"
+
+# The tweet fields kept in a snapshot
+SNAPSHOT_FIELDS = ["id", "user.id", "user.location", "user.description", "place.country_code", "geo"]
+
+
+def pack_strings(strings):
+    """
+    Packs a list of strings into a byte array of their UTF-8 encodings and
+    an array of len(strings) + 1 offsets, string i being the bytes from
+    offsets[i] to offsets[i + 1].
+    """
+    encoded = [s.encode("utf-8", "surrogatepass") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(data, offsets):
+    """
+    Returns the list of strings packed by pack_strings.
+    """
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[start:end].decode("utf-8", "surrogatepass") for start, end in zip(offsets, offsets[1:])]
+
+
+def build_snapshot(tweets):
+    """
+    Returns the snapshot arrays of the tweets, whose fields are those of
+    SNAPSHOT_FIELDS.
+    """
+    ids = []
+    user_ids = []
+    country_codes = []
+    has_country_codes = []
+    lats = []
+    lons = []
+    profile_rows = []
+    profiles = {}
+    for d in tweets:
+        ids.append(d["id"])
+        user_ids.append(d["user.id"])
+
+        country_code = d["place.country_code"]
+        country_codes.append(country_code or "")
+        has_country_codes.append(country_code is not None)
+
+        geo = d["geo"]
+        if geo is not None and geo["type"] == "Point":
+            lats.append(geo["coordinates"][0])
+            lons.append(geo["coordinates"][1])
+        else:
+            lats.append(np.nan)
+            lons.append(np.nan)
+
+        profile = (d["user.location"] or "", d["user.description"] or "")
+        profile_rows.append(profiles.setdefault(profile, len(profiles)))
+
+    location_data, location_offsets = pack_strings([location for location, _ in profiles])
+    description_data, description_offsets = pack_strings([description for _, description in profiles])
+    return {"id": np.array(ids, dtype=np.int64),
+            "user_id": np.array(user_ids, dtype=np.int64),
+            "country_code": np.array(country_codes, dtype=str),
+            "has_country_code": np.array(has_country_codes, dtype=bool),
+            "lat": np.array(lats, dtype=np.float64),
+            "lon": np.array(lons, dtype=np.float64),
+            "profile": np.array(profile_rows, dtype=np.int32),
+            "location_data": location_data,
+            "location_offsets": location_offsets,
+            "description_data": description_data,
+            "description_offsets": description_offsets}
+
+
+def write_snapshot(fpath, snapshot_path):
+    """
+    Writes the snapshot of a tweet file to snapshot_path.
+
+    Returns:
+        the number of tweets in the snapshot
+    """
+    snapshot = build_snapshot(read_tweets(fpath, fields=SNAPSHOT_FIELDS))
+    # write to a temporary file first, so that an interrupted run leaves no partial snapshot
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **snapshot)
+    os.replace(tmp_path, snapshot_path)
+    return len(snapshot["id"])
+
+
+def read_snapshot(snapshot_path):
+    """
+    Reads a snapshot written by write_snapshot.
+
+    Returns:
+        snapshot (dict): the arrays of the snapshot, with the profiles
+                         unpacked into the lists "locations" and
+                         "descriptions"
+    """
+    with np.load(snapshot_path) as f:
+        return unpack_snapshot({name: f[name] for name in f.files})
+
+
+def unpack_snapshot(snapshot):
+    """
+    Returns the arrays of a snapshot written by build_snapshot, with the
+    profiles unpacked into the lists "locations" and "descriptions".
+    """
+    snapshot = dict(snapshot)
+    snapshot["locations"] = unpack_strings(snapshot.pop("location_data"), snapshot.pop("location_offsets"))
+    snapshot["descriptions"] = unpack_strings(snapshot.pop("description_data"), snapshot.pop("description_offsets"))
+    return snapshot
+
+
+def snapshot_tweets(snapshot):
+    """
+    Yields the tweets of a snapshot as dicts with the fields used by
+    CanadianFilter.is_canadian, in the order of the tweet file.
+    """
+    # the user dicts of the tweets of a user with the same profile are equal
+    users = {}
+    columns = [snapshot[name].tolist() for name in
+               ["id", "user_id", "country_code", "has_country_code", "lat", "lon", "profile"]]
+    for tweet_id, user_id, country_code, has_country_code, lat, lon, profile in zip(*columns):
+        user = users.get((user_id, profile))
+        if user is None:
+            user = {"id": user_id,
+                    "location": snapshot["locations"][profile],
+                    "description": snapshot["descriptions"][profile]}
+            users[(user_id, profile)] = user
+        yield {"id": tweet_id,
+               "user": user,
+               "place": {"country_code": country_code} if has_country_code else None,
+               "geo": {"type": "Point", "coordinates": [lat, lon]} if lat == lat else None}
+
+
+def snapshot_path(snapshot_dir, fpath):
+    """
+    Returns the path of the snapshot of a tweet file.
+    """
+    return os.path.join(snapshot_dir, os.path.basename(fpath) + SNAPSHOT_SUFFIX)
+
+
+def _write_snapshot(args):
+    """
+    Unpacks the arguments of write_snapshot for Pool.imap.
+    """
+    fpath, path = args
+    print(f"Snapshotting '{fpath}'...")
+    return write_snapshot(fpath, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write snapshots of the tweet fields used by the Canadian filter")
+
+    parser.add_argument("input_path",
+                        help="The input folder containing .jsonl files, or a single .jsonl file",
+                        type = str)
+    parser.add_argument("output_path",
+                        help="The folder to which to write one snapshot per input file",
+                        type = str)
+    parser.add_argument("--jobs",
+                        help="The number of input files processed in parallel",
+                        type = int, default=1)
+
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input_path):
+        fpaths = [os.path.join(args.input_path, f) for f in sorted(os.listdir(args.input_path))]
+    else:
+        fpaths = [args.input_path]
+    os.makedirs(args.output_path, exist_ok=True)
+
+    tasks = [(fpath, snapshot_path(args.output_path, fpath)) for fpath in fpaths]
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs) as pool:
+            counts = list(pool.imap(_write_snapshot, tasks))
+    else:
+        counts = [_write_snapshot(task) for task in tasks]
+    print(f"Wrote snapshots of {sum(counts)} tweets from {len(fpaths)} files to {args.output_path}")
@@ -5,8 +5,12 @@ import argparse
 import json
 import os
 import time
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import reverse_geocoder as rg
+from functools import partial
+
+from tweet_reader import read_tweets
+from geocoding import get_geocoder, tweet_point, batches
+from extraction_driver import add_arguments, output_name, shard_paths, run_extraction
+from sentiment import get_scorer
 
 # Argparse for input json file, must be unzipped!
 parser = argparse.ArgumentParser(description="Extract all tweets geotagged in Canada, run vader on them, and store the tweets in an output folder")
@@ -19,31 +23,49 @@ parser.add_argument("output_path",
                     help="The output folder where geotagged tweets should be stored.",
                     type = str)
 
+parser.add_argument("--precheck",
+                    help="Do not reverse geocode the coordinates that are far outside of Canada",
+                    action="store_true")
+
+add_arguments(parser, shards=True)
+
 # Variables for index fields
 MEDIA = "media"
 RT_STATUS = "retweeted_status"
 ENTITIES = "entities"
 EXT_ENTITIES = "extended_entities"
 
-def process_tweet_file(inpath, out_json_file):
+def process_tweet_file(inpath, precheck=False):
     """
     Arguments:
         inpath: path to .jsonl file to process
-        out_json_file: .jsonl file object to which to store the extracted tweets
+        precheck: if True, the coordinates outside of a box around Canada are
+                  not reverse geocoded (see geocoding.CANADA_BOX)
 
     Returns:
-        None, but stores the tweets to the jsonl file represented by out_json_file
+        a generator of the Canadian tweets in the file, with their vader score
     """
-    analyser = SentimentIntensityAnalyzer()
+    # Compute the vader scores in batches
+    return get_scorer().score_tweets(canadian_tweets(inpath, precheck))
+
+def canadian_tweets(inpath, precheck=False):
+    """
+    Arguments:
+        inpath: path to .jsonl file to process
+        precheck: if True, the coordinates outside of a box around Canada are
+                  not reverse geocoded (see geocoding.CANADA_BOX)
 
+    Returns:
+        a generator of the Canadian tweets in the file
+    """
     i = 0
     canadian_cnt = 0
-    with open(inpath, "r") as json_file:
-        print("Processing '{}'...".format(fpath))
-        line = json_file.readline()
-
-        while line:
-            d = json.loads(line)
+    print("Processing '{}'...".format(inpath))
+    geocoder = get_geocoder()
+    for batch in batches(read_tweets(inpath)):
+        # Reverse geocode the coordinates of the whole batch at once
+        geocoder.prefetch(batch, precheck)
+        for d in batch:
             ID = d["id"]
 
             # Check if this tweet is Canadian, skip it otherwise
@@ -58,28 +80,17 @@ def process_tweet_file(inpath, out_json_file):
                     canadian = True
 
             # Check if the tweet is geotagged in Canada
-            if "geo" in d and d["geo"] != None:
-                geo = d["geo"]
-
-                if geo["type"] == "Point":
-                    coords = tuple(geo["coordinates"])
-                    location = rg.search(coords)[0]
-
-                    if location["cc"] == "CA":
-                        canadian = True
+            coords = tweet_point(d)
+            if coords is not None and geocoder.in_canada(coords, precheck):
+                canadian = True
             if canadian:
                 canadian_cnt += 1
 
-                # Compute the vader score
-                score = analyser.polarity_scores(d["full_text"])
-                d["vader_score"] = score
-
                 # store the tweet
-                print(json.dumps(d), file=out_json_file)
+                yield d
 
             # if the tweet is not Canadian or the field doesn't exist for any reason,
             # skip this user
-            line = json_file.readline()
             i += 1
     print(f"Found {canadian_cnt} Canadian tweets out of {i} total tweets")
 
@@ -98,14 +109,14 @@ if __name__ == "__main__":
         else:
             inp = inp[-2]
         out_file = os.path.join(out_dir, inp + ".jsonl")
-        print(out_file)
-        out_obj = open(out_file, "w")
-        for f in sorted(os.listdir(my_path)):
-            fpath = os.path.join(my_path, f)
-            process_tweet_file(fpath, out_obj)
+        fpaths = [os.path.join(my_path, f) for f in sorted(os.listdir(my_path))]
     else:
-        out_path = os.path.join(out_dir, args.input_path.split('/')[-1])
-        out_obj = open(out_path, "w")
-        process_tweet_file(fpath, out_obj)
-
-    out_obj.close()
+        out_file = os.path.join(out_dir, output_name(args.input_path))
+        fpaths = [my_path]
+
+    if args.shards:
+        out_file = None
+    print(out_file)
+    run_extraction(partial(process_tweet_file, precheck=args.precheck),
+                   fpaths, shard_paths(fpaths, out_dir, out_file), out_file,
+                   jobs=args.jobs, batch_size=args.batch_size)
@@ -8,8 +8,12 @@ import os
 import sys
 import time
 from copy import deepcopy
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import csv
+from functools import partial
+
+from tweet_reader import read_tweets, IDLineFilter, check_line_filter
+from extraction_driver import add_arguments, output_name, shard_paths, run_extraction
+from sentiment import get_scorer
 
 # Argparse for input json file, must be unzipped!
 parser = argparse.ArgumentParser(description="Extract all tweets geotagged in Canada, run vader on them, and store the tweets in an output folder")
@@ -22,54 +26,90 @@ parser.add_argument("output_path",
                     help="The output folder where geotagged tweets should be stored.",
                     type = str)
 
+parser.add_argument("--check-prefilter",
+                    help="Also parse every tweet to check that the byte-level pre-filter does not skip any tweet that should be extracted",
+                    action="store_true")
+
+add_arguments(parser, shards=True)
+
 # Variables for index fields
 MEDIA = "media"
 RT_STATUS = "retweeted_status"
 ENTITIES = "entities"
 EXT_ENTITIES = "extended_entities"
 
-def process_tweet_file(inpath, out_json_file):
+def is_by_or_mentioning_canadian(d):
+    """
+    Returns True if the tweet d is by or mentions a user in canadian_ids.
+    """
+    for mention in d["entities"]["user_mentions"]:
+        if mention["id_str"] in canadian_ids:
+            return True
+    return d["user"]["id_str"] in canadian_ids
+
+def set_canadian_ids(ids):
+    """
+    Sets the Canadian IDs in a worker process.
+    """
+    global canadian_ids
+    canadian_ids = ids
+
+def process_tweet_file(inpath, check_prefilter=False):
     """
     Arguments:
         inpath: path to .jsonl file to process
-        out_json_file: .jsonl file object to which to store the extracted tweets
+        check_prefilter: if True, first check that the pre-filter keeps every
+                         tweet that is extracted
 
     Returns:
-        None, but stores the tweets to the jsonl file represented by out_json_file
+        a generator of the tweets by or mentioning a Canadian in the file,
+        with their vader score
+    """
+    # perform vader sentiment analysis in batches
+    return get_scorer().score_tweets(canadian_tweets(inpath, check_prefilter))
+
+def canadian_tweets(inpath, check_prefilter=False):
+    """
+    Arguments:
+        inpath: path to .jsonl file to process
+        check_prefilter: if True, first check that the pre-filter keeps every
+                         tweet that is extracted
+
+    Returns:
+        a generator of the tweets by or mentioning a Canadian in the file
     """
-    analyser = SentimentIntensityAnalyzer()
     global canadian_ids
 
-    i = 0
     canadian_cnt = 0
-    with open(inpath, "r") as json_file:
-        print("Processing '{}'...".format(fpath))
-        line = json_file.readline()
-
-        while line:
-            d = json.loads(line)
-            ID = d["id"]
-
-            canadian_mentioned = False
-            for mention in d["entities"]["user_mentions"]:
-                if mention["id_str"] in canadian_ids:
-                    canadian_mentioned = True
-                    break
-
-            if d["user"]["id"] in canadian_ids or canadian_mentioned == True:
-                # perform vader sentiment analysis
-                canadian_cnt += 1
-                score = analyser.polarity_scores(d["full_text"])
-                d["vader_score"] = score
-
-                # store the tweet
-                print(json.dumps(d), file=out_json_file)
-
-            # if the tweet is not Canadian or the field doesn't exist for any reason,
-            # skip this user
-            line = json_file.readline()
-            i += 1
-    print(f"Found {canadian_cnt} tweets by a Canadian or mentioning a Canadian out of {i} total tweets")
+    print("Processing '{}'...".format(inpath))
+    if check_prefilter:
+        check(inpath)
+
+    # only parse the tweets whose raw line contains the ID of a Canadian
+    prefilter = IDLineFilter(canadian_ids)
+    for d in read_tweets(inpath, line_filter=prefilter):
+        ID = d["id"]
+
+        if is_by_or_mentioning_canadian(d):
+            canadian_cnt += 1
+
+            # store the tweet
+            yield d
+
+    print(f"Found {canadian_cnt} tweets by a Canadian or mentioning a Canadian out of {prefilter.num_lines} total tweets"
+          f" ({prefilter.num_kept} parsed)")
+
+def check(inpath):
+    """
+    Checks that the pre-filter keeps every tweet of the file that is by or
+    mentions a Canadian, raising an exception otherwise.
+    """
+    num_tweets, num_kept, num_matched, num_missed = check_line_filter(
+        inpath, IDLineFilter(canadian_ids), is_by_or_mentioning_canadian)
+    print(f"    Pre-filter check: kept {num_kept} of {num_tweets} tweets, "
+          f"{num_matched} match, {num_missed} missed")
+    if num_missed:
+        raise Exception("The pre-filter skipped {} matching tweets in {}".format(num_missed, inpath))
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -92,14 +132,15 @@ if __name__ == "__main__":
         else:
             inp = inp[-2]
         out_file = os.path.join(out_dir, inp + ".jsonl")
-        print(out_file)
-        out_obj = open(out_file, "w")
-        for f in sorted(os.listdir(my_path)):
-            fpath = os.path.join(my_path, f)
-            process_tweet_file(fpath, out_obj)
+        fpaths = [os.path.join(my_path, f) for f in sorted(os.listdir(my_path))]
     else:
-        out_path = os.path.join(out_dir, args.input_path.split('/')[-1])
-        out_obj = open(out_path, "w")
-        process_tweet_file(fpath, out_obj)
-
-    out_obj.close()
+        out_file = os.path.join(out_dir, output_name(args.input_path))
+        fpaths = [my_path]
+
+    if args.shards:
+        out_file = None
+    print(out_file)
+    run_extraction(partial(process_tweet_file, check_prefilter=args.check_prefilter),
+                   fpaths, shard_paths(fpaths, out_dir, out_file), out_file,
+                   jobs=args.jobs, batch_size=args.batch_size,
+                   initializer=set_canadian_ids, initargs=(canadian_ids,))
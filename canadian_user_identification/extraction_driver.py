@@ -0,0 +1,139 @@
+# Runs an extraction script over many tweet files in parallel.
+#
+# A script provides a function extract(inpath) that yields the tweets (dicts) to
+# keep from one input file. Each input file is handled by one worker process,
+# which writes the tweets it yields to its own output shard, serializing them in
+# batches. The shards can then be concatenated into one output file in the
+# order of the input files, so that the output is the same as for a serial run:
+#
+#     from extraction_driver import add_arguments, shard_paths, run_extraction
+#     ...
+#     add_arguments(parser, shards=True)
+#     args = parser.parse_args()
+#     if args.shards:
+#         out_path = None
+#     run_extraction(extract, fpaths, shard_paths(fpaths, out_dir, out_path), out_path,
+#                    jobs=args.jobs, batch_size=args.batch_size)
+
+import json
+import multiprocessing
+import os
+import shutil
+
+# The number of tweets serialized and written at a time
+BATCH_SIZE = 1000
+
+
+def add_arguments(parser, shards=False):
+    """
+    Adds the --jobs and --batch-size arguments to an argument parser, and
+    the --shards argument if shards is True.
+    """
+    parser.add_argument("--jobs",
+                        help="The number of input files processed in parallel",
+                        type = int, default=1)
+    parser.add_argument("--batch-size",
+                        help="The number of tweets serialized and written to the output at a time",
+                        type = int, default=BATCH_SIZE)
+    if shards:
+        parser.add_argument("--shards",
+                            help="Write one output file per input file, named after it, instead of a single output file",
+                            action="store_true")
+
+
+def output_name(fpath):
+    """
+    Returns the name of the output file written for an input file: its base
+    name, without the .gz suffix of a gzipped input, since the output is
+    not compressed.
+    """
+    name = os.path.basename(fpath)
+    if name.endswith(".gz"):
+        name = name[:-len(".gz")]
+    return name
+
+
+def shard_paths(fpaths, out_dir, out_path=None):
+    """
+    Returns the output shard of each input file: a file named after it (see
+    output_name) in out_dir or, if the shards are to be concatenated into
+    out_path, numbered temporary files next to out_path.
+    """
+    if out_path is None:
+        return [os.path.join(out_dir, output_name(fpath)) for fpath in fpaths]
+    return ["{}.{:06d}.part".format(out_path, k) for k in range(len(fpaths))]
+
+
+def write_shard(extract, inpath, shard_path, batch_size=BATCH_SIZE):
+    """
+    Writes the tweets extract(inpath) yields to shard_path, one json object
+    per line, batch_size tweets at a time.
+
+    Returns:
+        the number of tweets written
+    """
+    cnt = 0
+    batch = []
+    with open(shard_path, "w") as out:
+        for d in extract(inpath):
+            batch.append(d)
+            if len(batch) >= batch_size:
+                out.write("".join([json.dumps(t) + "\n" for t in batch]))
+                cnt += len(batch)
+                batch = []
+        out.write("".join([json.dumps(t) + "\n" for t in batch]))
+        cnt += len(batch)
+    return cnt
+
+
+def _write_shard(args):
+    """
+    Unpacks the arguments of write_shard for Pool.imap.
+    """
+    return write_shard(*args)
+
+
+def concatenate(shard_paths, out_path):
+    """
+    Concatenates the shards into out_path, in order, and removes them.
+    """
+    with open(out_path, "w") as out:
+        for shard_path in shard_paths:
+            with open(shard_path, "r") as shard:
+                shutil.copyfileobj(shard, out, 16 * 2 ** 20)
+            os.remove(shard_path)
+
+
+def run_extraction(extract, fpaths, shard_paths, out_path=None, jobs=1, batch_size=BATCH_SIZE,
+                   initializer=None, initargs=()):
+    """
+    Writes the tweets extract yields for each input file in fpaths to the
+    corresponding shard in shard_paths, using a pool of jobs processes if
+    jobs > 1, then concatenates the shards into out_path if it is given.
+
+    Arguments:
+        extract: a function of an input path yielding the tweets to write;
+                 it must be defined at the top level of a module
+        fpaths: the input files, in order
+        shard_paths: the output file of each input file
+        out_path: if given, the file into which the shards are concatenated
+        jobs: the number of worker processes
+        batch_size: the number of tweets serialized and written at a time
+        initializer, initargs: called as initializer(*initargs) in each worker,
+                               e.g., to set the global variables extract uses
+
+    Returns:
+        the total number of tweets written
+    """
+    tasks = [(extract, fpath, shard_path, batch_size) for fpath, shard_path in zip(fpaths, shard_paths)]
+    if jobs > 1:
+        print("Processing {} files with {} processes".format(len(tasks), jobs))
+        with multiprocessing.Pool(jobs, initializer=initializer, initargs=initargs) as pool:
+            counts = list(pool.imap(_write_shard, tasks))
+    else:
+        counts = [_write_shard(task) for task in tasks]
+
+    if out_path is not None:
+        concatenate(shard_paths, out_path)
+    print("Wrote {} tweets".format(sum(counts)))
+    return sum(counts)
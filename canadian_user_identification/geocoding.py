@@ -0,0 +1,156 @@
+# Reverse geocodes the coordinates of geotagged tweets to country codes, in
+# batches and with a cache.
+#
+# reverse_geocoder has a large overhead per call of rg.search, so the points of a
+# batch of tweets are looked up with a single search, in this process (mode=1,
+# which also works in the worker processes of a pool). The country code of each
+# point is cached on a grid of GRID_DIGITS decimal digits (0.0001 degrees, about
+# 11m): the points of one cell, e.g., the many tweets sent from the same place,
+# get the country code of the first of them that was looked up.
+#
+#     from geocoding import get_geocoder, tweet_point
+#     geocoder = get_geocoder()
+#     geocoder.prefetch(tweets)   # one search for the points not in the cache
+#     for d in tweets:
+#         cc = geocoder.country_code(tweet_point(d))   # from the cache
+#         ...
+#
+# Scripts outside of this folder add it to their path to import this module.
+
+from collections import OrderedDict
+
+import reverse_geocoder as rg
+
+# The number of decimal digits of the grid the country codes are cached on
+GRID_DIGITS = 4
+
+# The number of grid cells whose country codes are cached
+CACHE_SIZE = 100000
+
+# The number of tweets geocoded at a time
+BATCH_SIZE = 1000
+
+# A box around Canada, as (min lat, max lat, min lon, max lon), outside of which
+# reverse_geocoder never gives "CA": on a 0.1 degree grid, the points it geocodes
+# to Canada are within latitudes 29.8 to 90 and longitudes -142.4 to -39
+CANADA_BOX = (25.0, 90.0, -150.0, -30.0)
+
+_geocoder = None
+
+
+def tweet_point(tweet):
+    """
+    Returns the (lat, lon) coordinates a tweet is geotagged with, or None if
+    it has no "geo" Point.
+    """
+    geo = tweet.get("geo")
+    if geo is None or geo["type"] != "Point":
+        return None
+    return tuple(geo["coordinates"])
+
+
+def outside_canada(coords):
+    """
+    Returns True if the point is outside CANADA_BOX, so that it cannot be
+    geocoded to Canada.
+    """
+    lat, lon = coords
+    min_lat, max_lat, min_lon, max_lon = CANADA_BOX
+    return not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon)
+
+
+def batches(iterable, batch_size=BATCH_SIZE):
+    """
+    Yields lists of at most batch_size consecutive items of iterable.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CountryGeocoder:
+    def __init__(self, grid_digits=GRID_DIGITS, cache_size=CACHE_SIZE):
+        self.grid_digits = grid_digits
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.num_searched = 0
+        self.num_outside = 0
+
+    def cell(self, coords):
+        """
+        Returns the cache key of a point, its coordinates rounded to the grid.
+        """
+        return (round(coords[0], self.grid_digits), round(coords[1], self.grid_digits))
+
+    def country_codes(self, points):
+        """
+        Returns the country code of each point, looking up the points whose
+        grid cells are not in the cache with one search.
+
+        Arguments:
+            points: a list of (lat, lon) tuples
+
+        Returns:
+            codes (list): the country code of each point, e.g., "CA"
+        """
+        keys = [self.cell(coords) for coords in points]
+        cache = self.cache
+        new = {}
+        for key, coords in zip(keys, points):
+            if key in cache:
+                cache.move_to_end(key)
+            elif key not in new:
+                new[key] = coords
+        if new:
+            locations = rg.search(list(new.values()), mode=1)
+            self.num_searched += len(new)
+            new = {key: location["cc"] for key, location in zip(new, locations)}
+
+        codes = [new[key] if key in new else cache[key] for key in keys]
+        cache.update(new)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return codes
+
+    def country_code(self, coords):
+        """
+        Returns the country code of a (lat, lon) point.
+        """
+        return self.country_codes([coords])[0]
+
+    def in_canada(self, coords, precheck=False):
+        """
+        Returns True if a (lat, lon) point is geocoded to Canada. With
+        precheck, the points outside of CANADA_BOX are not looked up.
+        """
+        if precheck and outside_canada(coords):
+            self.num_outside += 1
+            return False
+        return self.country_code(coords) == "CA"
+
+    def prefetch(self, tweets, precheck=False):
+        """
+        Caches the country codes of the points the tweets are geotagged with,
+        with one search. With precheck, the points outside of CANADA_BOX are
+        skipped, as in_canada does not look them up.
+        """
+        points = [tweet_point(d) for d in tweets]
+        points = [coords for coords in points
+                  if coords is not None and not (precheck and outside_canada(coords))]
+        if points:
+            self.country_codes(points)
+
+
+def get_geocoder():
+    """
+    Returns the CountryGeocoder of this process, creating it on first use.
+    """
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = CountryGeocoder()
+    return _geocoder
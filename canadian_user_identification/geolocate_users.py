@@ -8,14 +8,21 @@
 # The result is a TSV file of
 #   user_ID \t latitude \t longitude
 # which can be used as seed data for the spatial label prop algorithm.
+# Rows are written as they are computed, so an interrupted run can be
+# continued with --resume.
 
 import argparse
 import json
 import os
 import sys
-from collections import defaultdict
-import geopy.distance
 import csv
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "spatial_label_propagation"))
+from slp.haversine import distance_sums
 
 # Argparse for input json file, must be unzipped!
 parser = argparse.ArgumentParser(description="Takes a jsonl file mapping users to their geotagged tweets, and, for users with at least 3 tweets geotagged within 100 km, computes the geometric median of all their geotagged tweets to determine a ground-truth location for that user.")
@@ -28,106 +35,278 @@ parser.add_argument("output_path",
                     help="The output tsv file where the output should be stored.",
                     type = str)
 
-users = dict()
+parser.add_argument("--dispersion",
+                    help="Add a fourth column with the sum of distances in km from each user's location to their geotagged tweets",
+                    action="store_true")
 
+parser.add_argument("--jobs",
+                    help="The number of worker processes locating users",
+                    type = int, default=1)
 
-def geometric_median(tweets, min_locs):
-    """
-    Computes the geometric median of a list of geotagged tweets.
-    Each tweet is expected to have the place object.
+parser.add_argument("--batch-size",
+                    help="The number of rows written to the output file at a time",
+                    type = int, default=1000)
 
-    Arguments:
-        tweets (list): the list of geotagged tweets from the given user
-        min_locs (int >= 1): the minimum number of geotagged tweets needed for a user to
-                             be assigned a location
+parser.add_argument("--resume",
+                    help="Keep the rows of an existing output file and skip the users they belong to",
+                    action="store_true")
 
-    Returns:
-        median (tuple): the lat/lon coordinates of the geometric median
+# The number of rows written to the output file at a time, and the number of
+# users sent to a worker process at a time
+BATCH_SIZE = 1000
+
+# The number of chunks of users read ahead per worker process
+CHUNKS_PER_JOB = 4
+
+
+def tweet_locations(tweets):
     """
-    # get a list of location tuples, in the form lat/lon
-    loc_list = []
-    for t in tweets:
+    Returns the (lat, lon) location of each tweet with a location, in the
+    order of the tweets, as an n x 2 array.
+    Tweets with coordinates use those, the others use the midpoint of the
+    bounding box of their place object.
+    """
+    geo = []
+    geo_index = []
+    polygons = []
+    place_index = []
+    for i, t in enumerate(tweets):
         # extract coordinates from the tweet, if available
         if "geo" in t and t["geo"] != None:
             # if there are coordinates, simply use those
-            loc_list.append(tuple(t["geo"]["coordinates"]))
+            geo.append(t["geo"]["coordinates"][:2])
+            geo_index.append(i)
         elif "place" in t and t["place"] != None:
             # otherwise, use place information
-            # since each polygon in the place object is a rectangle (at least in our data)
-            # we can just use a formula for the midpoint of a rectangle
-            # https://stackoverflow.com/questions/9734821/how-to-find-the-center-coordinate-of-rectangle
             polygon = t["place"]["bounding_box"]["coordinates"][0]
-
             if len(polygon) != 4:
                 # expected a rectangular polygon
                 print(json.dumps(t, indent=4))
                 print("Error: Found place object whose polygon was not rectangular!")
                 sys.exit()
+            polygons.append(polygon)
+            place_index.append(i)
+
+    # since each polygon in the place object is a rectangle (at least in our data)
+    # we can just use a formula for the midpoint of a rectangle, using the
+    # opposite corners 0 and 2 of each polygon, stored as (lon, lat)
+    # https://stackoverflow.com/questions/9734821/how-to-find-the-center-coordinate-of-rectangle
+    corners = np.asarray(polygons, dtype=np.float64).reshape(-1, 4, 2)[:, [0, 2], :]
+    low = corners.min(axis=1)
+    midpoints = low + (corners.max(axis=1) - low) / 2
 
-            x1 = polygon[0][0]
-            x2 = polygon[2][0]
-            y1 = polygon[0][1]
-            y2 = polygon[2][1]
+    # put the locations back in the order of the tweets
+    order = np.argsort(np.array(geo_index + place_index, dtype=np.int64), kind='stable')
+    locations = np.concatenate([np.asarray(geo, dtype=np.float64).reshape(-1, 2),
+                                midpoints[:, ::-1]])
+    return locations[order]
 
-            if x2 < x1:
-                x1, x2 = x2, x1
-            if y2 < y1:
-                y1, y2 = y2, y1
 
-            y_width = (y2 - y1)
-            x_width = (x2 - x1)
-            midpoint = (y1 + y_width / 2, x1 + x_width/2)
-            loc_list.append(midpoint)
+def geometric_median(tweets, min_locs, return_score=False):
+    """
+    Computes the geometric median of a list of geotagged tweets, i.e., the
+    tweet location with the smallest sum of great circle distances to the
+    locations of the other tweets.
+    Each tweet is expected to have the place object.
+
+    Arguments:
+        tweets (list): the list of geotagged tweets from the given user
+        min_locs (int >= 1): the minimum number of geotagged tweets needed for a user to
+                             be assigned a location
+        return_score (bool): if True, also return the sum of distances in km
+                             from the median to all the locations
 
-    if len(loc_list) < min_locs:
+    Returns:
+        median (tuple): the lat/lon coordinates of the geometric median,
+                        or (median, score) if return_score is True
+    """
+    locations = tweet_locations(tweets)
+
+    if len(locations) < min_locs or len(locations) == 0:
         # There were not enough tweets with locations to safely estimate
         return None
 
-    median = None
-    best_sum = float('inf')
-    for i in range(len(loc_list)):
-        sum_dist = 0
-        for j in range(len(loc_list)):
-            # extract coordinates, recall that each loc_list element
-            # is (lat,lon), country
-            coords1 = loc_list[i]
-            coords2 = loc_list[j]
-            d = geopy.distance.geodesic(coords1, coords2).km
-            sum_dist += d
-
-        if sum_dist < best_sum:
-            median = loc_list[i]
-            best_sum = sum_dist
+    sums = distance_sums(locations[:, 0], locations[:, 1])
+    # argmin returns the first minimum, like the pairwise loop this replaces
+    best = int(np.argmin(sums))
+    median = (float(locations[best, 0]), float(locations[best, 1]))
+    if return_score:
+        return median, float(sums[best])
     return median
 
 
-def process_tweet_file(inpath, min_tweets=3):
+def line_user_id(line):
+    """
+    Returns the user ID of a line of the input file, as a string. Lines
+    written by group_tweets_by_user.py start with the user ID, which is read
+    without parsing the tweets.
+    """
+    if line.startswith('{"user": '):
+        end = line.find(", ", 9)
+        if end != -1:
+            try:
+                return str(json.loads(line[9:end]))
+            except ValueError:
+                pass
+    return str(json.loads(line)["user"])
+
+
+def locate_users(lines, min_tweets=3, dispersion=False):
     """
     Arguments:
-        inpath: path to .jsonl file to process
+        lines: lines of a .jsonl file to process
         min_tweets (int): the minimum number of tweets that must be geotagged within
                           a 100 km radius for each user, defaults to 3.
+        dispersion (bool): if True, add the score of each median to its row,
+                           see geometric_median
 
-    Returns:
-        None, but stores the results in the global user dictionary
+    Yields:
+        row (list): the [user_id, lat, lon] row (with the score if dispersion
+                    is True) of each located user, in the order of the lines
+    """
+    for line in lines:
+        d = json.loads(line)
+        # get the user ID
+        user_id = d["user"]
+        tweets = d["tweets"] # list of geotagged tweets from this user
+        # try to find a ground-truth location for this user
+        median = geometric_median(tweets, min_tweets, return_score=dispersion)
+        if median != None:
+            if dispersion:
+                median = median[0] + (median[1],)
+            yield [user_id] + list(median)
+
+
+def process_tweet_file(inpath, done, min_tweets=3, dispersion=False):
+    """
+    Yields the rows of the located users of a .jsonl file (see locate_users),
+    in file order, skipping the users whose IDs (as strings) are in done.
+    The file is read as the rows are consumed, so users added to done in the
+    meantime are skipped too.
     """
-    global users
     with open(inpath, "r") as json_file:
-        print("Processing '{}'...".format(inpath))
-        line = json_file.readline()
-
-        while line:
-            d = json.loads(line)
-            # get the user ID
-            user_id = d["user"]
-            tweets = d["tweets"] # list of geotagged tweets from this user
-            # try to find a ground-truth location for this user
-            median = geometric_median(tweets, min_tweets)
-            if median != None:
-                print(median)
-                users[user_id] = median
-
-            line = json_file.readline()
+        lines = (line for line in json_file if line_user_id(line) not in done)
+        yield from locate_users(lines, min_tweets, dispersion)
+
+
+def user_chunks(fpaths, done, chunk_size):
+    """
+    Yields (fpath, lines) chunks of at most chunk_size lines of the given
+    files, in order, skipping the users whose IDs (as strings) are in done.
+    """
+    for fpath in fpaths:
+        with open(fpath, "r") as json_file:
+            chunk = []
+            for line in json_file:
+                if line_user_id(line) in done:
+                    continue
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield fpath, chunk
+                    chunk = []
+            if chunk:
+                yield fpath, chunk
+
+
+def chunk_rows(lines, min_tweets=3, dispersion=False):
+    """
+    Returns the list of rows of locate_users, for a worker process.
+    """
+    return list(locate_users(lines, min_tweets, dispersion))
+
+
+def read_done_users(out_file):
+    """
+    Returns the set of user IDs already in the output file, as strings, and
+    removes a partially written last row, if any, so that new rows can be
+    appended to it.
+    """
+    done = set()
+    if not os.path.exists(out_file):
+        return done
+    with open(out_file, "rb+") as f:
+        complete = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            done.add(line.split(b"\t", 1)[0].decode())
+            complete += len(line)
+        f.truncate(complete)
+    return done
+
+
+def geolocate_files(fpaths, out_file, jobs=1, batch_size=BATCH_SIZE, dispersion=False, resume=False):
+    """
+    Geolocates the users in the given files, writing the row of each located
+    user to the output tsv file as it is computed, in batches of batch_size
+    rows, in the order of the files. With jobs > 1, chunks of batch_size
+    users are located by a pool of jobs worker processes, with at most
+    CHUNKS_PER_JOB chunks per worker in flight: the oldest chunk is written
+    before the next one is sent.
+
+    With resume, the rows already in out_file are kept and the users they
+    belong to are skipped. A user is written at most once, for the first
+    file the user is located in.
+    """
+    done = read_done_users(out_file) if resume else set()
+    if done:
+        print("Resuming: skipping {} users already in '{}'".format(len(done), out_file))
+
+    num_rows = 0
+    with open(out_file, "a" if resume else "w") as out_obj:
+        tsv_writer = csv.writer(out_obj, delimiter="\t")
+        batch = []
+        located = {fpath: 0 for fpath in fpaths}
+
+        def write_rows(fpath, rows):
+            nonlocal num_rows, batch
+            for row in rows:
+                located[fpath] += 1
+                if str(row[0]) in done:
+                    continue
+                done.add(str(row[0]))
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    tsv_writer.writerows(batch)
+                    out_obj.flush()
+                    num_rows += len(batch)
+                    batch = []
+
+        # the number of files whose users have all been written
+        num_processed = 0
+
+        def print_processed(until):
+            nonlocal num_processed
+            while num_processed < until:
+                fpath = fpaths[num_processed]
+                print("Processed '{}': {} users located".format(fpath, located[fpath]))
+                num_processed += 1
+
+        if jobs > 1:
+            with multiprocessing.Pool(jobs) as pool:
+                # the chunks sent to the workers, oldest first, so that the
+                # rows are written in order with a bounded number in flight
+                in_flight = deque()
+                for fpath, lines in user_chunks(fpaths, done, batch_size):
+                    if len(in_flight) >= jobs * CHUNKS_PER_JOB:
+                        result, chunk_fpath = in_flight.popleft()
+                        print_processed(fpaths.index(chunk_fpath))
+                        write_rows(chunk_fpath, result.get())
+                    in_flight.append((pool.apply_async(chunk_rows, (lines, 3, dispersion)), fpath))
+                while in_flight:
+                    result, chunk_fpath = in_flight.popleft()
+                    print_processed(fpaths.index(chunk_fpath))
+                    write_rows(chunk_fpath, result.get())
+        else:
+            for i, fpath in enumerate(fpaths):
+                write_rows(fpath, process_tweet_file(fpath, done, 3, dispersion))
+                print_processed(i + 1)
+        print_processed(len(fpaths))
+
+        tsv_writer.writerows(batch)
+        num_rows += len(batch)
+    print("Wrote {} users to '{}'".format(num_rows, out_file))
+
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -135,17 +314,11 @@ if __name__ == "__main__":
     my_path = os.path.join(os.getcwd(), args.input_path)
 
     out_file = os.path.join(os.getcwd(), args.output_path)
-    out_obj = open(out_file, "w")
 
     if os.path.isdir(my_path):
-        for f in sorted(os.listdir(my_path)):
-            fpath = os.path.join(my_path, f)
-            process_tweet_file(fpath)
+        fpaths = [os.path.join(my_path, f) for f in sorted(os.listdir(my_path))]
     else:
-        process_tweet_file(my_path)
-
-    tsv_writer = csv.writer(out_obj, delimiter="\t")
-    for user, median in users.items():
-        tsv_writer.writerow([user, median[0], median[1]])
+        fpaths = [my_path]
 
-    out_obj.close()
+    geolocate_files(fpaths, out_file, jobs=args.jobs, batch_size=args.batch_size,
+                    dispersion=args.dispersion, resume=args.resume)
@@ -5,7 +5,14 @@ import argparse
 import json
 import os
 import sys
+import heapq
+import itertools
+import shutil
+import tempfile
 from collections import defaultdict
+from operator import itemgetter
+
+from tweet_reader import read_tweets
 
 # Argparse for input json file, must be unzipped!
 parser = argparse.ArgumentParser(description="Groups the tweets in the input folder by user ID.")
@@ -18,36 +25,165 @@ parser.add_argument("output_path",
                     help="The output jsonl file where the output should be stored.",
                     type = str)
 
+parser.add_argument("--external",
+                    help="Group the tweets with an external sort on disk instead of in memory; users are then written in order of user ID",
+                    action="store_true")
+
+parser.add_argument("--memory-mb",
+                    help="With --external, the approximate memory in MB used to buffer tweets before they are written to a sorted run file",
+                    type = int, default=1024)
+
+parser.add_argument("--tmp-dir",
+                    help="With --external, the folder in which the run files are stored (by default, the system temporary folder)",
+                    type = str, default=None)
+
+parser.add_argument("--fields",
+                    help="Only keep these top-level fields of each tweet, e.g., --fields geo place",
+                    nargs="+", default=None)
+
 # Variables for index fields
 MEDIA = "media"
 RT_STATUS = "retweeted_status"
 ENTITIES = "entities"
 EXT_ENTITIES = "extended_entities"
 
+# The approximate memory in bytes used per buffered tweet, besides its JSON string
+RECORD_OVERHEAD = 120
+
+# The largest number of run files merged at once
+MAX_MERGE_RUNS = 256
+
 users = defaultdict(list)
 
-def process_tweet_file(inpath):
+def project(d, fields):
+    """
+    Returns the tweet d with only the given fields, or d itself if fields is None.
+    """
+    if fields is None:
+        return d
+    return {field: d.get(field) for field in fields}
+
+def tweet_files(my_path):
+    """
+    Returns the paths of the tweet files to process, in order.
+    """
+    if os.path.isdir(my_path):
+        return [os.path.join(my_path, f) for f in sorted(os.listdir(my_path))]
+    return [my_path]
+
+def process_tweet_file(inpath, fields=None):
     """
     Arguments:
         inpath: path to .jsonl file to process
+        fields: the fields of each tweet to keep, or None to keep all of them
 
     Returns:
         None, but stores the tweets in the user dictionary
     """
     global users
-    with open(inpath, "r") as json_file:
-        print("Processing '{}'...".format(inpath))
-        line = json_file.readline()
+    print("Processing '{}'...".format(inpath))
+    for d in read_tweets(inpath):
+        # get the user ID
+        user_id = d["user"]["id"]
+
+        # add to our map
+        users[user_id].append(project(d, fields))
+
+def write_run(records, tmp_dir):
+    """
+    Sorts the (user_id, tweet_json) records by user ID, keeping the tweets of
+    each user in their original order, and writes them to a new run file in
+    tmp_dir, one "user_id\ttweet_json" line per tweet.
 
-        while line:
-            d = json.loads(line)
-            # get the user ID
-            user_id = d["user"]["id"]
+    Returns:
+        the path of the run file
+    """
+    records.sort(key=itemgetter(0))
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "w") as run:
+        for user_id, tweet in records:
+            run.write("{}\t{}\n".format(user_id, tweet))
+    return path
+
+def read_run(path):
+    """
+    Streams the (user_id, tweet_json) records of a run file.
+    """
+    with open(path, "r") as run:
+        for line in run:
+            user_id, tweet = line.rstrip("\n").split("\t", 1)
+            yield int(user_id), tweet
+
+def merge_runs(paths):
+    """
+    Streams the records of the sorted run files in order of user ID. Ties
+    are broken by the order of the runs, so the tweets of each user stay in
+    the order they were read.
+    """
+    return heapq.merge(*[read_run(path) for path in paths], key=itemgetter(0))
+
+def sorted_runs(fpaths, tmp_dir, memory_bytes, fields=None):
+    """
+    Reads the tweet files in order, spilling the buffered tweets to a sorted
+    run file whenever they take up more than about memory_bytes. Runs are
+    merged into larger runs while there are more than MAX_MERGE_RUNS of them.
 
-            # add to our map
-            users[user_id].append(d)
+    Returns:
+        the paths of the run files, in the order of the tweets they hold
+    """
+    runs = []
+    records = []
+    size = 0
+    for inpath in fpaths:
+        print("Processing '{}'...".format(inpath))
+        for d in read_tweets(inpath):
+            tweet = json.dumps(project(d, fields))
+            records.append((d["user"]["id"], tweet))
+            size += len(tweet) + RECORD_OVERHEAD
+            if size >= memory_bytes:
+                runs.append(write_run(records, tmp_dir))
+                records = []
+                size = 0
+    if records:
+        runs.append(write_run(records, tmp_dir))
+    print("Wrote {} sorted run files".format(len(runs)))
+
+    while len(runs) > MAX_MERGE_RUNS:
+        merged = []
+        for start in range(0, len(runs), MAX_MERGE_RUNS):
+            group = runs[start:start + MAX_MERGE_RUNS]
+            fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+            with os.fdopen(fd, "w") as run:
+                for user_id, tweet in merge_runs(group):
+                    run.write("{}\t{}\n".format(user_id, tweet))
+            for old in group:
+                os.remove(old)
+            merged.append(path)
+        runs = merged
+    return runs
+
+def group_external(fpaths, out_obj, memory_bytes, tmp_dir=None, fields=None):
+    """
+    Groups the tweets in the tweet files by user with an external sort: the
+    tweets are spilled to sorted run files and k-way merged, writing one
+    { "user" : user_id, "tweets" : list_of_tweets } line per user, in order
+    of user ID, in a single pass over the runs.
 
-            line = json_file.readline()
+    Returns:
+        counts: the number of users with each number of tweets (10 for 10 or more)
+    """
+    counts = defaultdict(int)
+    run_dir = tempfile.mkdtemp(prefix="group_tweets_", dir=tmp_dir)
+    try:
+        runs = sorted_runs(fpaths, run_dir, memory_bytes, fields)
+        for user_id, records in itertools.groupby(merge_runs(runs), key=itemgetter(0)):
+            tweets = [tweet for _, tweet in records]
+            counts[min(len(tweets), 10)] += 1
+            # the same line json.dumps writes for the in-memory grouping
+            out_obj.write('{"user": ' + json.dumps(user_id) + ', "tweets": [' + ", ".join(tweets) + ']}\n')
+    finally:
+        shutil.rmtree(run_dir)
+    return counts
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -57,12 +193,15 @@ if __name__ == "__main__":
     out_file = os.path.join(os.getcwd(), args.output_path)
     out_obj = open(out_file, "w")
 
-    if os.path.isdir(my_path):
-        for f in sorted(os.listdir(my_path)):
-            fpath = os.path.join(my_path, f)
-            process_tweet_file(fpath)
-    else:
-        process_tweet_file(my_path)
+    if args.external:
+        counts = group_external(tweet_files(my_path), out_obj, args.memory_mb * 2 ** 20,
+                                args.tmp_dir, args.fields)
+        print(counts)
+        out_obj.close()
+        sys.exit()
+
+    for fpath in tweet_files(my_path):
+        process_tweet_file(fpath, args.fields)
 
 
     counts = defaultdict(int)
@@ -0,0 +1,103 @@
+# Adds VADER sentiment scores to tweets, in batches and with a cache.
+#
+# Retweets repeat the same full_text many times, so the texts of a batch of
+# tweets are scored once each, and the scores are kept in a bounded LRU cache
+# keyed by a hash of the text. Each process uses one analyzer and one cache for
+# all the files it processes (see get_scorer):
+#
+#     from sentiment import get_scorer
+#     for d in get_scorer().score_tweets(tweets):
+#         # d["vader_score"] is set
+#         ...
+
+import hashlib
+from collections import OrderedDict
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+# The number of texts whose scores are cached
+CACHE_SIZE = 100000
+
+# The number of tweets scored at a time
+BATCH_SIZE = 1000
+
+_scorer = None
+
+
+def text_key(text):
+    """
+    Returns the cache key of a text, a 16 byte hash.
+    """
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class SentimentScorer:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.analyser = SentimentIntensityAnalyzer()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.num_texts = 0
+        self.num_scored = 0
+
+    def score_texts(self, texts):
+        """
+        Returns the VADER polarity scores of each text, scoring each distinct
+        text that is not in the cache once.
+
+        Arguments:
+            texts: a list of strings
+
+        Returns:
+            scores (list): the polarity score dict of each text
+        """
+        keys = [text_key(text) for text in texts]
+        cache = self.cache
+        new = {}
+        for key, text in zip(keys, texts):
+            if key in cache:
+                cache.move_to_end(key)
+            elif key not in new:
+                new[key] = self.analyser.polarity_scores(text)
+        self.num_texts += len(texts)
+        self.num_scored += len(new)
+
+        scores = [new[key] if key in new else cache[key] for key in keys]
+        cache.update(new)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return scores
+
+    def add_scores(self, tweets, field="full_text"):
+        """
+        Sets the "vader_score" of each tweet to the polarity scores of its
+        text field.
+        """
+        scores = self.score_texts([d[field] for d in tweets])
+        for d, score in zip(tweets, scores):
+            # each tweet gets its own copy of a shared score
+            d["vader_score"] = dict(score)
+
+    def score_tweets(self, tweets, batch_size=BATCH_SIZE, field="full_text"):
+        """
+        Yields the tweets, in order, with their "vader_score" set, scoring
+        them batch_size at a time.
+        """
+        batch = []
+        for d in tweets:
+            batch.append(d)
+            if len(batch) >= batch_size:
+                self.add_scores(batch, field)
+                yield from batch
+                batch = []
+        self.add_scores(batch, field)
+        yield from batch
+
+
+def get_scorer():
+    """
+    Returns the SentimentScorer of this process, creating it on first use.
+    """
+    global _scorer
+    if _scorer is None:
+        _scorer = SentimentScorer()
+    return _scorer
@@ -8,9 +8,11 @@ import os
 import sys
 import time
 from copy import deepcopy
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import csv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sentiment import get_scorer
+
 # Argparse for input json file, must be unzipped!
 parser = argparse.ArgumentParser(description="Extract all tweets geotagged in Canada, run vader on them, and store the tweets in an output folder")
 
@@ -28,46 +30,48 @@ RT_STATUS = "retweeted_status"
 ENTITIES = "entities"
 EXT_ENTITIES = "extended_entities"
 
-def process_tweet_file(inpath):
+def canadian_tweets(inpath):
     """
     Arguments:
         inpath: path to .jsonl file to process
 
     Returns:
-        None, but stores the tweets to the jsonl file represented by out_json_file
+        a generator of the tweets by a Canadian in the file
     """
-    analyser = SentimentIntensityAnalyzer()
     global canadian_ids
 
-    out_file = os.path.join(out_dir, inpath.split("/")[-1])
-    out_json_file = open(out_file, "w")
-    print(out_file)
-
     i = 0
     canadian_cnt = 0
     with open(inpath, "r") as json_file:
-        print("Processing '{}'...".format(fpath))
-        line = json_file.readline()
-
-        while line:
+        print("Processing '{}'...".format(inpath))
+        for line in json_file:
             d = json.loads(line)
-            ID = d["id"]
 
-            if d["user"]["id"] in canadian_ids:
-                # perform vader sentiment analysis
+            if d["user"]["id_str"] in canadian_ids:
                 canadian_cnt += 1
-                score = analyser.polarity_scores(d["full_text"])
-                d["vader_score"] = score
-
-                # store the tweet
-                print(json.dumps(d), file=out_json_file)
+                yield d
 
             # if the tweet is not Canadian or the field doesn't exist for any reason,
             # skip this user
-            line = json_file.readline()
             i += 1
     print(f"Found {canadian_cnt} tweets by a Canadian out of {i} total tweets")
-    out_json_file.close()
+
+def process_tweet_file(inpath):
+    """
+    Arguments:
+        inpath: path to .jsonl file to process
+
+    Returns:
+        None, but stores the tweets to the jsonl file represented by out_json_file
+    """
+    out_file = os.path.join(out_dir, inpath.split("/")[-1])
+    print(out_file)
+
+    with open(out_file, "w") as out_json_file:
+        # perform vader sentiment analysis in batches
+        for d in get_scorer().score_tweets(canadian_tweets(inpath)):
+            # store the tweet
+            print(json.dumps(d), file=out_json_file)
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -80,11 +84,11 @@ if __name__ == "__main__":
     # note we expect ground truth has no header
     with open("canadian_users.tsv", "r") as f:
         reader = csv.reader(f, delimiter='\t')
-        canadian_ids = set([int(i[0]) for i in reader])
+        canadian_ids = set([i[0] for i in reader])
 
     if os.path.isdir(my_path):
         for f in sorted(os.listdir(my_path)):
             fpath = os.path.join(my_path, f)
             process_tweet_file(fpath)
     else:
-        process_tweet_file(fpath)
+        process_tweet_file(my_path)
@@ -0,0 +1,68 @@
+# Compares the running time of the median functions available to SLP (see the
+# "median" setting in slp/settings.py) on random neighbourhoods of increasing size.
+# Run from the spatial_label_propagation directory.
+import argparse
+import random
+import time
+
+from slp.spatial_label_propagation import get_geometric_median, get_distance
+from slp.median import get_medoid, get_weiszfeld_median
+
+parser = argparse.ArgumentParser(description="Times the geopy geometric median against the NumPy medoid and Weiszfeld medians on random sets of locations.")
+
+parser.add_argument("--sizes",
+                    help="The neighbourhood sizes to time",
+                    type = int, nargs="+", default=[10, 50, 200, 1000])
+parser.add_argument("--repeats",
+                    help="The number of random neighbourhoods of each size",
+                    type = int, default=3)
+parser.add_argument("--seed",
+                    help="The random seed used to generate locations",
+                    type = int, default=0)
+
+
+def random_locations(n):
+    """
+    Returns n random (lat, lon) locations spread over a few Canadian cities.
+    """
+    cities = [(43.65, -79.38), (45.50, -73.57), (49.28, -123.12), (51.05, -114.07), (53.55, -113.49)]
+    locations = []
+    for _ in range(n):
+        lat, lon = random.choice(cities)
+        locations.append((lat + random.gauss(0, 0.5), lon + random.gauss(0, 0.5)))
+    return locations
+
+
+def time_median(median, neighbourhoods):
+    start = time.time()
+    results = [median(locations) for locations in neighbourhoods]
+    return time.time() - start, results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print("%6s %10s %10s %10s %10s %10s %10s" % ("n", "geopy (s)", "medoid (s)", "speedup",
+                                                 "weisz (s)", "speedup", "same"))
+    for n in args.sizes:
+        neighbourhoods = [random_locations(n) for _ in range(args.repeats)]
+        geopy_time, geopy_medians = time_median(get_geometric_median, neighbourhoods)
+        medoid_time, medoids = time_median(get_medoid, neighbourhoods)
+        weiszfeld_time, weiszfeld_medians = time_median(get_weiszfeld_median, neighbourhoods)
+
+        # how often the haversine medoid picks the same neighbour as geopy
+        same = sum(1 for a, b in zip(geopy_medians, medoids) if a == b)
+        print("%6d %10.4f %10.4f %9.1fx %10.4f %9.1fx %7d/%d" % (n, geopy_time, medoid_time,
+                                                       geopy_time / medoid_time,
+                                                       weiszfeld_time,
+                                                       geopy_time / weiszfeld_time,
+                                                       same, args.repeats))
+
+        # the Weiszfeld median should never be further from the other points
+        # in total than the medoid, up to the haversine/geodesic difference
+        for locations, medoid, median in zip(neighbourhoods, geopy_medians, weiszfeld_medians):
+            medoid_sum = sum(get_distance(medoid, p) for p in locations)
+            median_sum = sum(get_distance(median, p) for p in locations)
+            if median_sum > medoid_sum * 1.01:
+                print("    warning: Weiszfeld sum %.1f km exceeds medoid sum %.1f km" % (median_sum, medoid_sum))
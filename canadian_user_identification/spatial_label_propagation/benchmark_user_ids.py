@@ -0,0 +1,107 @@
+# Compares the memory used by the user ID structures of SLP when user IDs are
+# kept as strings (as the pipeline used to) and as int64 IDs with dense vertex
+# indices (as it does now), on a synthetic graph with 5M vertices by default.
+# Needs a few GB of memory at the default size.
+# Run from the spatial_label_propagation directory.
+import argparse
+import gc
+import tracemalloc
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description="Measures the memory of string-keyed and integer-keyed user ID structures.")
+
+parser.add_argument("--vertices",
+                    help="The number of vertices (users) in the graph",
+                    type = int, default=5000000)
+parser.add_argument("--located",
+                    help="The fraction of users with a location estimate",
+                    type = float, default=0.5)
+parser.add_argument("--seed",
+                    help="The random seed used to generate user IDs",
+                    type = int, default=0)
+
+
+def random_user_ids(n, rng):
+    """
+    Returns n distinct random user IDs that look like Twitter IDs: a mix of
+    older 8-10 digit IDs and newer 18-19 digit ones.
+    """
+    old = rng.integers(10 ** 7, 4 * 10 ** 9, n // 2)
+    new = rng.integers(7 * 10 ** 17, 1600 * 10 ** 15, n - n // 2)
+    return np.unique(np.concatenate([old, new]))[:n]
+
+
+def measure(build):
+    """
+    Returns the number of bytes allocated by build() and still in use when
+    it returns, together with its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def string_interning(ids):
+    """
+    The dict from user ID string to vertex used while building a dataset.
+    """
+    return {str(user): vertex for vertex, user in enumerate(ids.tolist())}
+
+
+def integer_interning(ids):
+    """
+    The same dict with integer user IDs as keys.
+    """
+    return {user: vertex for vertex, user in enumerate(ids.tolist())}
+
+
+def string_training(ids, located):
+    """
+    The vertex map and location estimates SLP used to train on: a list of user
+    ID strings and a dict from user ID string to (lat, lon).
+    """
+    vertex2user = [str(user) for user in ids.tolist()]
+    estimates = {vertex2user[vertex]: (45.0, -75.0) for vertex in located.tolist()}
+    return vertex2user, estimates
+
+
+def integer_training(ids, located):
+    """
+    The vertex map and location estimates the csr engine trains on: an int64
+    array and vertex-indexed lat/lon arrays with a has-location mask.
+    """
+    vertex_user_ids = np.array(ids, dtype=np.int64)
+    lat = np.zeros(len(ids))
+    lon = np.zeros(len(ids))
+    has_location = np.zeros(len(ids), dtype=bool)
+    lat[located] = 45.0
+    lon[located] = -75.0
+    has_location[located] = True
+    return vertex_user_ids, (lat, lon, has_location)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    ids = random_user_ids(args.vertices, rng)
+    located = np.flatnonzero(rng.random(len(ids)) < args.located)
+
+    print("%d vertices, %d located" % (len(ids), len(located)))
+    print("%-28s %10s %10s %9s" % ("structure", "str (MB)", "int (MB)", "ratio"))
+    rows = [("build: interning dict", lambda: string_interning(ids), lambda: integer_interning(ids)),
+            ("train: vertex map", lambda: string_training(ids, located)[0],
+                                  lambda: integer_training(ids, located)[0]),
+            ("train: location estimates", lambda: string_training(ids, located)[1],
+                                          lambda: integer_training(ids, located)[1]),
+            # the estimates share their key strings with the vertex map
+            ("train: total", lambda: string_training(ids, located),
+                             lambda: integer_training(ids, located))]
+    for name, string_build, integer_build in rows:
+        string_size, _ = measure(string_build)
+        integer_size, _ = measure(integer_build)
+        print("%-28s %10.1f %10.1f %8.1fx" % (name, string_size / 2 ** 20, integer_size / 2 ** 20,
+                                              string_size / integer_size))
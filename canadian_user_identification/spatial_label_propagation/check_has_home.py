@@ -0,0 +1,95 @@
+# Checks that has_home (slp/home_location.py) gives the same answer as the
+# original exhaustive search, has_home_exhaustive, and compares their running
+# times, on synthetic users whose GPS locations are spread around a few Canadian
+# cities, or on the GPS-tagged tweets of the given gzipped JSON files.
+# The exhaustive search is exponential, so it is skipped for users with more
+# than --max-points locations.
+# Run from the spatial_label_propagation directory.
+import argparse
+import gzip
+import json
+import random
+import time
+from collections import defaultdict
+
+from geopy.point import Point
+
+from slp.spatial_label_propagation import has_home, has_home_exhaustive
+
+parser = argparse.ArgumentParser(description="Compares has_home with the exhaustive subset search it replaced.")
+
+parser.add_argument("tweet_files",
+                    help="Gzipped files of one tweet JSON object per line; synthetic users are used if none are given",
+                    nargs="*")
+parser.add_argument("--users",
+                    help="The number of synthetic users",
+                    type = int, default=500)
+parser.add_argument("--max-points",
+                    help="The largest number of locations of a user checked with the exhaustive search",
+                    type = int, default=40)
+parser.add_argument("--seed",
+                    help="The random seed used to generate locations",
+                    type = int, default=0)
+
+
+def random_user(n):
+    """
+    Returns n random Points around one to three Canadian cities, with a spread
+    that often puts groups of points close to 15km apart.
+    """
+    cities = [(43.65, -79.38), (45.50, -73.57), (49.28, -123.12), (51.05, -114.07), (53.55, -113.49)]
+    centres = random.sample(cities, random.randint(1, 3))
+    spread = random.choice([0.02, 0.05, 0.08, 0.12, 0.3])
+    locations = []
+    for _ in range(n):
+        lat, lon = random.choice(centres)
+        locations.append(Point(lat + random.gauss(0, spread), lon + random.gauss(0, spread)))
+    return locations
+
+
+def read_tweet_locations(tweet_files):
+    """
+    Returns the list of GPS Points of each user in the tweet files, read the
+    same way get_home_location does.
+    """
+    user_locations = defaultdict(list)
+    for fname in tweet_files:
+        with gzip.open(fname, 'rt') as fh:
+            for line in fh:
+                tweet = json.loads(line)
+                coords = tweet.get("coordinates")
+                if coords is None or coords.get("type") != "Point":
+                    continue
+                lon, lat = coords["coordinates"][0], coords["coordinates"][1]
+                user_locations[tweet["user"]["id_str"]].append(Point(lat, lon))
+    return [locations for locations in user_locations.values() if len(locations) >= 5]
+
+
+def time_calls(function, users):
+    start = time.time()
+    results = [function(locations) for locations in users]
+    return time.time() - start, results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.tweet_files:
+        users = read_tweet_locations(args.tweet_files)
+    else:
+        users = [random_user(random.randint(5, 2 * args.max_points)) for _ in range(args.users)]
+
+    checked = [locations for locations in users if len(locations) <= args.max_points]
+    fast_time, fast = time_calls(has_home, checked)
+    exhaustive_time, exhaustive = time_calls(has_home_exhaustive, checked)
+    mismatches = sum(1 for a, b in zip(fast, exhaustive) if a != b)
+    print("%d users with at most %d locations, %d with a home" % (len(checked), args.max_points, sum(exhaustive)))
+    print("exhaustive: %.3fs  has_home: %.3fs  speedup: %.1fx  mismatches: %d"
+          % (exhaustive_time, fast_time, exhaustive_time / max(fast_time, 1e-9), mismatches))
+
+    rest = [locations for locations in users if len(locations) > args.max_points]
+    if rest:
+        rest_time, rest_results = time_calls(has_home, rest)
+        print("has_home only: %d users with up to %d locations, %d with a home, %.3fs"
+              % (len(rest), max(len(locations) for locations in rest), sum(rest_results), rest_time))
@@ -10,8 +10,11 @@ import gzip
 import time
 
 from slp.build_dataset import posts2dataset
+from slp.build_home_locations import build_home_locations as build_home_location_file
 from slp.sparse_dataset import SparseDataset
+from slp.location_store import convert_dataset as convert_dataset_files
 from slp.spatial_label_propagation import SpatialLabelPropagation
+from slp.settings import GEOPY_MEDIAN, MEDOID_MEDIAN, WEISZFELD_MEDIAN
 
 def train(args):
     parser = argparse.ArgumentParser(prog='geoinf train',description='train a geoinference method on a specific dataset')
@@ -22,6 +25,12 @@ def train(args):
     parser.add_argument('model_dir',help='a (non-existing) directory where the trained model will be stored')
     parser.add_argument('--location-source', nargs=1,
                             help='specifies the source of ground-truth locations')
+    parser.add_argument('--workers', type=int, default=None,
+                            help='the number of processes used to compute the location estimates')
+    parser.add_argument('--frontier', action='store_true',
+                            help='only recompute users whose neighbourhood changed, stopping early on convergence')
+    parser.add_argument('--warm-start', metavar='MODEL_DIR', default=None,
+                            help='start from the locations estimated by the model in MODEL_DIR')
 
     args = parser.parse_args(args)
 
@@ -54,6 +63,14 @@ def train(args):
                              % location_source)
                 settings['location_source'] = location_source
 
+        if args.workers is not None:
+                settings['workers'] = args.workers
+
+        if args.frontier:
+                settings['frontier'] = True
+
+        if args.warm_start is not None:
+                settings['warm_start'] = args.warm_start
 
 
     # load the dataset
@@ -90,18 +107,55 @@ def build_dataset(args):
     parser.add_argument('user_id_field',help='the field name holding the user id of the post author')
     parser.add_argument('mention_field',help='the field name holding the list of user ids mentioned in a post (or the friends of a user, those they follow)')
     parser.add_argument('follow_field',help='the field name holding the list of user ids following the given user', nargs='?', type=str, default=None)
+    parser.add_argument('--jobs', type=int, default=1,
+                            help='the number of processes used to read the posts files')
+    parser.add_argument('--update', action='store_true',
+                            help='add the posts files not seen before to an existing dataset')
 
     args = parser.parse_args(args)
 
     uid_field_name = args.user_id_field.split('.')[::-1]
     mention_field_name = args.mention_field.split('.')[::-1]
-    posts2dataset(args.dataset_dir,args.posts_file, args.user_id_field, args.mention_field, args.follow_field)
+    posts2dataset(args.dataset_dir,args.posts_file, args.user_id_field, args.mention_field, args.follow_field, args.jobs, args.update)
 
     # done
 
+def convert_dataset(args):
+    parser = argparse.ArgumentParser(prog='geoinf convert_dataset',description='convert the vertex map and home locations of a dataset to the binary store')
+    parser.add_argument('dataset_dir',help='a directory containing a geoinference dataset')
+    parser.add_argument('location_file',help='the gzipped tsv file of ground-truth locations', nargs='?', type=str, default=None)
+
+    args = parser.parse_args(args)
+
+    location_file = args.location_file
+    if location_file is None:
+        location_file = os.path.join(args.dataset_dir, 'users.home-locations.geo-median.tsv.gz')
+    convert_dataset_files(args.dataset_dir, location_file)
+
+def build_home_locations(args):
+    parser = argparse.ArgumentParser(prog='geoinf build_home_locations',description='find the home location of users from their GPS-tagged posts')
+    parser.add_argument('output_file',help='the gzipped tsv file of home locations to write, e.g., users.home-locations.geo-median.tsv.gz')
+    parser.add_argument('users_files',help='gzipped user post files, or directories containing them', nargs='+')
+    parser.add_argument('--jobs', type=int, default=1,
+                            help='the number of processes used to find the home locations')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='the number of users sent to a process at a time')
+    parser.add_argument('--median', choices=[GEOPY_MEDIAN, MEDOID_MEDIAN, WEISZFELD_MEDIAN], default=MEDOID_MEDIAN,
+                            help='how the home location is computed from the GPS locations, as the median setting (default: medoid)')
+
+    args = parser.parse_args(args)
+
+    users_fnames = []
+    for path in args.users_files:
+        if os.path.isdir(path):
+            users_fnames.extend(os.path.join(path, fname) for fname in sorted(os.listdir(path)))
+        else:
+            users_fnames.append(path)
+    build_home_location_file(users_fnames, args.output_file, args.jobs, args.chunk_size, args.median)
+
 def main():
     parser = argparse.ArgumentParser(prog='geoinf',description='run a spatial label propagation method on a dataset')
-    parser.add_argument('action',choices=['train','build_dataset'],
+    parser.add_argument('action',choices=['train','build_dataset','convert_dataset','build_home_locations'],
             help='indicate whether to train the model or create a dataset')
     parser.add_argument('action_args',nargs=argparse.REMAINDER,
             help='arguments specific to the chosen action')
@@ -113,6 +167,10 @@ def main():
             train(args.action_args)
         elif args.action == 'build_dataset':
             build_dataset(args.action_args)
+        elif args.action == 'convert_dataset':
+            convert_dataset(args.action_args)
+        elif args.action == 'build_home_locations':
+            build_home_locations(args.action_args)
         else:
             raise Exception('unknown action: %s' % args.action)
 
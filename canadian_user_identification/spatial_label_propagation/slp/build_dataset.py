@@ -16,8 +16,12 @@ import json
 import os, os.path
 import gzip
 import networkit as nk
+import numpy as np
 import sys
 import csv
+import multiprocessing
+from array import array
+from slp.location_store import write_vertex_user_ids, write_touched_user_ids
 
 def index_json(idx_string, obj):
     """
@@ -58,9 +62,20 @@ def index_json(idx_string, obj):
         # otherwise, our string is at least X.Y so we need to recurse
         return index_json(".".join(indices[1::]), result)
 
-def posts2dataset(dataset_dir,posts_dir,extract_user_id,extract_mentions, extract_incoming=None):
+def posts2dataset(dataset_dir,posts_dir,extract_user_id,extract_mentions, extract_incoming=None, jobs=1,
+                  update=False):
     """
+    Creates dataset_dir and builds the mention network of the posts in
+    posts_dir in it, reading up to jobs posts files in parallel. With update,
+    an existing dataset in dataset_dir is instead extended with the posts
+    files it has not ingested yet.
     """
+    if update and os.path.exists(dataset_dir):
+        print('Updating the network...')
+        posts2mention_network(posts_dir, extract_user_id, extract_mentions, working_dir=dataset_dir,
+                              extract_incoming_edges=extract_incoming, jobs=jobs, update=True)
+        return
+
     # handle the dataset directory existence issue
     if os.path.exists(dataset_dir):
         question = "Would you like to remove the existing dataset directory %s?" % dataset_dir
@@ -74,117 +89,381 @@ def posts2dataset(dataset_dir,posts_dir,extract_user_id,extract_mentions, extrac
 
     # now make the mention network
     print('Building the network...')
-    posts2mention_network(posts_dir, extract_user_id,extract_mentions, working_dir=dataset_dir, extract_incoming_edges=extract_incoming)
+    posts2mention_network(posts_dir, extract_user_id,extract_mentions, working_dir=dataset_dir, extract_incoming_edges=extract_incoming, jobs=jobs)
 
     # done!
     return
 
-def posts2mention_network(posts_dir,extract_user_id,
-                          extract_mentions,working_dir=None, extract_incoming_edges=None):
+def intern_user(vertices, user_id):
+    """
+    Returns the vertex descriptor of the given integer user ID, assigning the next
+    free descriptor if the user has not been seen before. Descriptors are
+    assigned in the order in which the users first appear in the posts.
     """
-    This method builds a valid `mention_network.elist` file from the
-    `posts.json.gz` file specified. Unless indicated otherwise, the
-    directory containing the posts file will be used as the working
-    and output directory for the construction process.
+    v = vertices.get(user_id)
+    if v is None:
+        v = len(vertices)
+        vertices[user_id] = v
+    return v
 
-    extract_incoming_edges: is None if there are no incoming edges for a given object,
-                    or is a string like extract_mentions if there are incoming edges
-                    (e.g., None for mention graphs, but a string for followers)
+class EdgeCounts(object):
+    """
+    Counts the directed edges (source, target) between vertex descriptors.
 
+    Edges are appended to growable integer buffers and periodically reduced
+    into a sorted table of unique edge keys and their counts, where the key
+    of an edge is source << VERTEX_BITS | target. Partial tables counted
+    elsewhere can be merged in as well. Reducing whenever the pending edges
+    are at least as many as the table keeps the total sorting work at
+    O(E log E) while repeated mentions only take up space until the next
+    reduction.
     """
-    G = nk.graph.Graph(weighted=True, directed=True)
 
-    # figure out the working dir
-    if not working_dir:
-        working_dir = os.path.dirname(posts_dir)
+    # The number of bits in an edge key used for the target vertex
+    VERTEX_BITS = 32
+
+    # The smallest number of pending edges before a reduction
+    MIN_BUFFER_SIZE = 1 << 20
+
+    def __init__(self):
+        self._sources = array('q')
+        self._targets = array('q')
+        # partial (keys, counts) tables waiting to be merged into the table
+        self._pending = []
+        self._num_pending = 0
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+
+    def add(self, source, target):
+        """
+        Counts one occurrence of the edge (source, target).
+        """
+        self._sources.append(source)
+        self._targets.append(target)
+        self._num_pending += 1
+        if self._num_pending >= max(len(self._keys), self.MIN_BUFFER_SIZE):
+            self._reduce()
+
+    def add_counts(self, sources, targets, counts):
+        """
+        Counts each edge (sources[i], targets[i]) counts[i] times.
+        """
+        self._pending.append(((sources << self.VERTEX_BITS) | targets, counts))
+        self._num_pending += len(sources)
+        if self._num_pending >= max(len(self._keys), self.MIN_BUFFER_SIZE):
+            self._reduce()
+
+    def _reduce(self):
+        """
+        Merges the buffered edges and partial tables into the table of edge
+        counts.
+        """
+        sources = np.frombuffer(self._sources, dtype=np.int64)
+        targets = np.frombuffer(self._targets, dtype=np.int64)
+        keys = np.concatenate([self._keys, (sources << self.VERTEX_BITS) | targets]
+                              + [keys for keys, _ in self._pending])
+        counts = np.concatenate([self._counts, np.ones(len(sources), dtype=np.int64)]
+                                + [counts for _, counts in self._pending])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse, weights=counts, minlength=len(self._keys)).astype(np.int64)
+        del sources, targets
+        self._sources = array('q')
+        self._targets = array('q')
+        self._pending = []
+        self._num_pending = 0
+
+    def edges(self):
+        """
+        Returns (sources, targets, counts), the unique directed edges sorted
+        by source and then by target, and how often each was counted.
+        """
+        self._reduce()
+        mask = (1 << self.VERTEX_BITS) - 1
+        return self._keys >> self.VERTEX_BITS, self._keys & mask, self._counts
+
+def reciprocal_edges(sources, targets, touched_sources=None, touched_targets=None):
+    """
+    Returns the subset of the touched edges (by default, all the edges) whose
+    reverse edge is among the sorted unique directed edges (sources,
+    targets), leaving out self-loops. The result keeps the order of the
+    touched edges.
+    """
+    if touched_sources is None:
+        touched_sources, touched_targets = sources, targets
+    keys = (sources << EdgeCounts.VERTEX_BITS) | targets
+    reverse_keys = (touched_targets << EdgeCounts.VERTEX_BITS) | touched_sources
+    positions = np.minimum(np.searchsorted(keys, reverse_keys), max(len(keys) - 1, 0))
+    keep = (keys[positions] == reverse_keys) & (touched_sources != touched_targets)
+    return touched_sources[keep], touched_targets[keep]
+
+def count_mention_edges(posts_fname, extract_user_id, extract_mentions,
+                        vertices, edge_counts, extract_incoming_edges=None):
+    """
+    Streams the gzipped posts in posts_fname, adding a vertex descriptor to
+    vertices for every user ID seen and counting each mention (or follow)
+    as a directed edge in edge_counts.
 
+    Returns:
+        cnt: the number of posts read
+    """
     cnt = 0
-    # maps user id --> vertex descriptor
-    vertices = dict()
-    for posts_fname in os.listdir(posts_dir):
-        fh = gzip.open(os.path.join(posts_dir, posts_fname),'r')
-        print(f"Processing {posts_fname}...")
+    with gzip.open(posts_fname, 'r') as fh:
         for line in fh:
             cnt += 1
             post = json.loads(line)
             # NOTE: this works to extract follow relations too, even if this variable
             # is called "mentions"
             mentions = index_json(extract_mentions, post)
-            uid = str(index_json(extract_user_id, post))
-
-            # vertex for this user
-            if uid not in vertices:
-                v = G.addNode() # v is an integer descriptor
-                vertices[uid] = v
+            uid = int(index_json(extract_user_id, post))
+            uv = intern_user(vertices, uid)
+            is_retweet = "retweeted_status" in post
 
             for m in mentions:
-                m = str(m)
-                if m not in vertices:
-                    v = G.addNode()
-                    vertices[m] = v
-                uv = vertices[uid]
-                mv = vertices[m]
-
-                if uid == m and "retweeted_status" in post:
+                m = int(m)
+                mv = intern_user(vertices, m)
+                if uid == m and is_retweet:
                     # this is a retweet. Retweets automatically mention the retweeting
                     # user, for some reason?
                     continue
-                if G.hasEdge(uv, mv):
-                    # if m is already a target of this user, this is not the
-                    # first time uid has mentioned m
-                    # find the existing edge and simply increase its weight
-                    w = G.weight(uv, mv)
-                    G.setWeight(uv, mv, w+1)
-                else:
-                    # this is the first time uid has mentioned m
-                    G.addEdge(uv, mv, 1)
+                edge_counts.add(uv, mv)
 
             if extract_incoming_edges:
                 followers = index_json(extract_incoming_edges, post)
                 for m in followers:
-                    m = str(m)
-                    if m not in vertices:
-                        v = G.addNode()
-                        vertices[m] = v
-                    uv = vertices[uid]
-                    mv = vertices[m]
-
-                    if uid == m and "retweeted_status" in post:
+                    m = int(m)
+                    mv = intern_user(vertices, m)
+                    if uid == m and is_retweet:
                         continue
+                    edge_counts.add(mv, uv)
+    return cnt
+
+def file_edge_counts(posts_fname, extract_user_id, extract_mentions, extract_incoming_edges=None):
+    """
+    Counts the mention edges of a single posts file, numbering the users by
+    their first appearance in that file. Used by the worker processes of a
+    parallel build.
+
+    Returns:
+        (cnt, users, sources, targets, counts): the number of posts read, the
+                                                user ID of each local vertex
+                                                descriptor and the edge counts
+                                                in terms of these descriptors
+    """
+    vertices = dict()
+    edge_counts = EdgeCounts()
+    cnt = count_mention_edges(posts_fname, extract_user_id, extract_mentions,
+                              vertices, edge_counts, extract_incoming_edges)
+    sources, targets, counts = edge_counts.edges()
+    return (cnt, list(vertices), sources, targets, counts)
+
+def _file_edge_counts(args):
+    """
+    Unpacks the arguments of file_edge_counts for Pool.imap.
+    """
+    print(f"Processing {os.path.basename(args[0])}...")
+    return file_edge_counts(*args)
+
+def count_posts_files(posts_fnames, extract_user_id, extract_mentions,
+                      vertices, edge_counts, extract_incoming_edges=None, jobs=1):
+    """
+    Counts the mention edges of all the given posts files into edge_counts,
+    interning the users in vertices as for a serial read of the files in
+    order.
+
+    With jobs > 1, each posts file is counted by one of jobs worker
+    processes into a partial table of edge counts over its own vertex
+    descriptors. The tables are merged in the order of the files, interning
+    the users of each file in order, so that the vertex descriptors are the
+    same as for a serial read.
+
+    Returns:
+        cnt: the number of posts read
+    """
+    cnt = 0
+    if jobs > 1:
+        print(f"Reading {len(posts_fnames)} files with {jobs} processes")
+        tasks = [(posts_fname, extract_user_id, extract_mentions, extract_incoming_edges)
+                 for posts_fname in posts_fnames]
+        with multiprocessing.Pool(jobs) as pool:
+            for file_cnt, users, sources, targets, counts in pool.imap(_file_edge_counts, tasks):
+                cnt += file_cnt
+                # map the file's vertex descriptors to the global ones
+                descriptors = np.array([intern_user(vertices, user) for user in users], dtype=np.int64)
+                edge_counts.add_counts(descriptors[sources], descriptors[targets], counts)
+    else:
+        for posts_fname in posts_fnames:
+            print(f"Processing {os.path.basename(posts_fname)}...")
+            cnt += count_mention_edges(posts_fname, extract_user_id, extract_mentions,
+                                       vertices, edge_counts, extract_incoming_edges)
+    return cnt
+
+def posts2mention_network(posts_dir,extract_user_id,
+                          extract_mentions,working_dir=None, extract_incoming_edges=None, jobs=1,
+                          update=False):
+    """
+    This method builds the bidirectional mention network of the gzipped
+    posts files in posts_dir and writes it to `saved_graph.gt`, together with
+    the map from vertex descriptors to user IDs in `vertex_to_userID.csv`.
+    Unless indicated otherwise, the directory containing posts_dir will be
+    used as the working and output directory for the construction process.
+
+    The posts are streamed once, collecting each mention as a pair of integer
+    vertex descriptors. Repeated mentions are then counted by sorting, the
+    reciprocal pairs are found with a binary search over the sorted edges and
+    the final graph is created in one call from the remaining edges.
+
+    The directed edge counts, all the interned user IDs and the names of the
+    ingested posts files are saved next to the graph (see save_edge_counts).
+    With update, they are loaded again and only the posts files that have not
+    been ingested yet are read. Counts only grow, so edges that were
+    reciprocal stay reciprocal and only the new edges need to be checked for
+    a reverse edge. The result is the same as a full build that reads the
+    previously ingested files first.
+
+    extract_incoming_edges: is None if there are no incoming edges for a given object,
+                    or is a string like extract_mentions if there are incoming edges
+                    (e.g., None for mention graphs, but a string for followers)
+    jobs: the number of processes used to read the posts files
+    update: if True, add the posts files not ingested yet to the dataset in
+            working_dir instead of building it from scratch
+
+    """
+    # figure out the working dir
+    if not working_dir:
+        working_dir = os.path.dirname(posts_dir)
+
+    fields = {"user_id_field": extract_user_id,
+              "mention_field": extract_mentions,
+              "incoming_field": extract_incoming_edges}
+    if update:
+        vertices, edge_counts, reciprocal, manifest = load_edge_counts(working_dir)
+        for field, value in fields.items():
+            if manifest[field] != value:
+                raise Exception("The dataset in %s was built with %s %s, not %s"
+                                % (working_dir, field, manifest[field], value))
+        ingested = manifest["posts_files"]
+    else:
+        # maps user id --> vertex descriptor
+        vertices = dict()
+        edge_counts = EdgeCounts()
+        reciprocal = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        ingested = []
 
-                    if G.hasEdge(mv, uv):
-                        # if uid is already a target of this user,
-                        # find the existing edge and simply increase its weight
-                        w = G.weight(mv, uv)
-                        G.setWeight(mv, uv, w+1)
-                    else:
-                        # this is the first time uid has mentioned m
-                        G.addEdge(mv, uv, 1)
-            #  print("User", uid)
-            #  print("Mentions", mentions)
-            #  print(vertices)
-            #  print(list(G.iterNodes()))
-            #  print(list(G.iterEdgesWeights()))
-            #  sys.exit()
+    seen = set(ingested)
+    new_fnames = [posts_fname for posts_fname in os.listdir(posts_dir) if posts_fname not in seen]
+    if update:
+        print(f"Found {len(new_fnames)} new posts files ({len(ingested)} already ingested)")
+
+    new_counts = EdgeCounts()
+    cnt = count_posts_files([os.path.join(posts_dir, posts_fname) for posts_fname in new_fnames],
+                            extract_user_id, extract_mentions, vertices, new_counts,
+                            extract_incoming_edges, jobs)
+    new_sources, new_targets, new_weights = new_counts.edges()
+    del new_counts
+    if update:
+        edge_counts.add_counts(new_sources, new_targets, new_weights)
+        sources, targets, counts = edge_counts.edges()
+    else:
+        sources, targets, counts = new_sources, new_targets, new_weights
     print(f"Processed {cnt} total objects.")
-    print(f"Found {G.numberOfNodes()} vertices and {G.numberOfEdges()} edges.")
+    print(f"Found {len(vertices)} vertices and {len(sources)} edges.")
 
-    # iterate over all edges (source, target)
     # if both (source, target) and (target, source) are edges,
     # then keep the edges
     # otherwise, remove them
-    edges = list(G.iterEdges())
-    for source, target in edges:
-        if (not G.hasEdge(target, source)) or target == source:
-            G.removeEdge(source, target)
-    print(f"Found {G.numberOfNodes()} vertices and {G.numberOfEdges()} bidirectional edges.")
+    # Only the edges counted just now can have become reciprocal, together
+    # with their reverse edges
+    touched_sources, touched_targets = reciprocal_edges(sources, targets, new_sources, new_targets)
+    shift = EdgeCounts.VERTEX_BITS
+    old_keys = (reciprocal[0] << shift) | reciprocal[1]
+    reciprocal_keys = np.unique(np.concatenate([old_keys,
+                                                (touched_sources << shift) | touched_targets,
+                                                (touched_targets << shift) | touched_sources]))
+    reciprocal = (reciprocal_keys >> shift, reciprocal_keys & ((1 << shift) - 1))
+    print(f"Found {len(vertices)} vertices and {len(reciprocal[0])} bidirectional edges.")
 
+    # With update, the users with a new bidirectional edge (both directions
+    # are in reciprocal_keys) are the only ones whose adjacency list changed,
+    # which lets a warm-started SLP run skip the others at first
+    touched_user_ids = None
+    if update:
+        added_keys = np.setdiff1d(reciprocal_keys, old_keys, assume_unique=True)
+        user_ids = np.fromiter(vertices.keys(), dtype=np.int64, count=len(vertices))
+        touched_user_ids = user_ids[np.unique(added_keys >> shift)]
+        print(f"{len(touched_user_ids)} users have new bidirectional edges.")
 
-    # Remove any vertices with degree 0 from the final graph
-    for vstr, v in list(vertices.items()):
-      if G.degree(v) == 0:
-          G.removeNode(v)
-          del vertices[vstr]
+    fields["posts_files"] = ingested + new_fnames
+    save_edge_counts(working_dir, vertices, sources, targets, counts, reciprocal, fields)
+    write_touched_user_ids(working_dir, touched_user_ids)
+    write_network(working_dir, vertices, reciprocal[0], reciprocal[1])
+
+    # done
+    return
+
+def save_edge_counts(working_dir, vertices, sources, targets, counts, reciprocal, manifest):
+    """
+    Saves what is needed to update the dataset in working_dir later:
+        edge_counts.npz: the directed edges and their counts, and the
+                         bidirectional edges, in terms of vertex descriptors
+        user_ids.txt: the user ID of every vertex descriptor, one per line,
+                      including users whose vertex is not in the graph
+        manifest.json: the names of the ingested posts files and the fields
+                       used to extract the edges
+    """
+    print("Writing edge counts...", end=" ")
+    np.savez(os.path.join(working_dir, 'edge_counts.npz'), sources=sources, targets=targets,
+             counts=counts, reciprocal_sources=reciprocal[0], reciprocal_targets=reciprocal[1])
+    with open(os.path.join(working_dir, 'user_ids.txt'), 'w') as f:
+        for user in vertices:
+            f.write('%d\n' % user)
+    with open(os.path.join(working_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    print("Done!")
+
+def load_edge_counts(working_dir):
+    """
+    Loads the files written by save_edge_counts.
+
+    Returns:
+        (vertices, edge_counts, reciprocal, manifest): the map from user ID to
+                                                       vertex descriptor, the
+                                                       EdgeCounts, the
+                                                       (sources, targets) of
+                                                       the bidirectional edges
+                                                       and the manifest
+    """
+    manifest_path = os.path.join(working_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        raise Exception("The dataset in %s has no edge counts to update, please rebuild it"
+                        % working_dir)
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    vertices = dict()
+    with open(os.path.join(working_dir, 'user_ids.txt'), 'r') as f:
+        for line in f:
+            intern_user(vertices, int(line))
+
+    saved = np.load(os.path.join(working_dir, 'edge_counts.npz'))
+    edge_counts = EdgeCounts()
+    edge_counts.add_counts(saved['sources'], saved['targets'], saved['counts'])
+    reciprocal = (saved['reciprocal_sources'], saved['reciprocal_targets'])
+    return vertices, edge_counts, reciprocal, manifest
+
+def write_network(working_dir, vertices, sources, targets):
+    """
+    Writes the graph with the given sorted bidirectional edges to
+    `saved_graph.gt` in working_dir, leaving out any vertices with degree 0,
+    and the user ID of each remaining vertex to `vertex_to_userID.csv`.
+    """
+    # Remove any vertices with degree 0 from the final graph, numbering the
+    # remaining vertices 0..n-1 in their original order. Every edge has its
+    # reverse edge, so the vertices with degree > 0 are exactly the sources.
+    kept = np.zeros(len(vertices), dtype=bool)
+    kept[sources] = True
+    condensed = np.cumsum(kept) - 1
+    num_kept = int(np.count_nonzero(kept))
+    G = nk.GraphFromCoo((condensed[sources], condensed[targets]), n=num_kept, directed=True)
 
     print(f"Found {G.numberOfNodes()} vertices with degree > 0 and {G.numberOfEdges()} bidirectional edges.")
 
@@ -197,19 +476,17 @@ def posts2mention_network(posts_dir,extract_user_id,
     nk.writeGraph(G, dest, nk.Format.GraphToolBinary)
     print("Done!")
 
-    # TODO: write vertex map and also add code to load it in / pass it around
     print("Writing user ID to vertex map...", end=" ")
     vertex_path = os.path.join(working_dir,'vertex_to_userID.csv')
     with open(vertex_path, "w") as f:
         writer = csv.writer(f)
-        # saving the graph will condense the vertex IDs, so make sure
-        # to save the condensed IDs (ranging from 0 to numNodes-1) accordingly
-        u2v = list(sorted(vertices.items(), key=lambda x: x[1]))
+        # the vertex IDs are condensed to range from 0 to numNodes-1, so
+        # write the condensed IDs accordingly
         idx = 0
-        for user, vertex in u2v:
-            writer.writerow([idx, user])
-            idx += 1
+        for user, vertex in vertices.items():
+            if kept[vertex]:
+                writer.writerow([idx, user])
+                idx += 1
     print("Done!")
 
-    # done
-    return
+    write_vertex_user_ids(working_dir, [user for user, vertex in vertices.items() if kept[vertex]])
@@ -0,0 +1,167 @@
+"""
+This file contains code for building the ground truth home locations of a
+dataset from the GPS-tagged posts of its users.
+
+The input is one or more gzipped user post files, with one JSON object per
+line holding all the posts of one user, either as
+
+    {"user_id": USER_ID, "posts": [post, ...]}
+
+(the format read by SparseDataset.post_iter) or as
+
+    {"user": USER_ID, "tweets": [tweet, ...]}
+
+(the output of group_tweets_by_user.py). A user gets a home location if at
+least 5 of their GPS-tagged posts are within 15km of each other (see
+get_home_location), at the median selected by the median argument (see
+get_median_function; the NumPy medoid by default, since the geopy geometric
+median of a user with thousands of posts takes minutes), and the output is
+the gzipped
+
+    USER_ID\tLAT\tLON
+
+file that SparseDataset reads its ground truth locations from.
+"""
+import gzip
+import json
+import multiprocessing
+import os, os.path
+import time
+from collections import deque
+
+from slp.settings import MEDOID_MEDIAN
+from slp.spatial_label_propagation import get_home_location, get_median_function
+
+# The number of users sent to a worker process at a time
+CHUNK_SIZE = 1000
+
+# The number of seconds between two progress reports
+PROGRESS_INTERVAL = 10
+
+
+def load_user(line):
+    """
+    Parses one line of a user post file into a dict with the fields
+    user_id and posts.
+    """
+    user = json.loads(line)
+    if "user_id" not in user:
+        user = {"user_id": user["user"], "posts": user["tweets"]}
+    return user
+
+
+def user_chunks(users_fnames, chunk_size=CHUNK_SIZE):
+    """
+    Streams the lines of the user post files, yielding lists of at most
+    chunk_size unparsed lines together with the number of bytes read.
+    """
+    for users_fname in users_fnames:
+        print(f"Processing {os.path.basename(users_fname)}...")
+        with gzip.open(users_fname, 'rb') as fh:
+            chunk = []
+            num_bytes = 0
+            for line in fh:
+                chunk.append(line)
+                num_bytes += len(line)
+                if len(chunk) == chunk_size:
+                    yield chunk, num_bytes
+                    chunk = []
+                    num_bytes = 0
+            if chunk:
+                yield chunk, num_bytes
+
+
+def chunk_home_locations(lines, median=MEDOID_MEDIAN):
+    """
+    Finds the home location of the user of each line, using the median
+    function named by median (a value of the median setting).
+
+    Returns:
+        (homes, num_posts): the (user_id, lat, lon) of the users with a home
+        location, in the order of the lines, and the number of posts read
+    """
+    median_function = get_median_function(median)
+    homes = []
+    num_posts = 0
+    for line in lines:
+        user = load_user(line)
+        num_posts += len(user["posts"])
+        home = get_home_location(user["posts"], median_function)
+        if home is not None:
+            homes.append((int(user["user_id"]), home[0], home[1]))
+    return homes, num_posts
+
+
+class Progress(object):
+    """
+    Counts the users, posts and bytes processed and prints them, with the
+    throughput so far, at most every interval seconds.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.start = time.time()
+        self.last_report = self.start
+        self.users = 0
+        self.located = 0
+        self.posts = 0
+        self.bytes = 0
+
+    def add(self, num_users, num_located, num_posts, num_bytes):
+        self.users += num_users
+        self.located += num_located
+        self.posts += num_posts
+        self.bytes += num_bytes
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        print(f"{self.users} users ({self.located} located), {self.posts} posts in {elapsed:.0f}s: "
+              f"{self.users / elapsed:.0f} users/s, {self.posts / elapsed:.0f} posts/s, "
+              f"{self.bytes / elapsed / 2 ** 20:.1f} MB/s")
+
+
+def build_home_locations(users_fnames, output_fname, jobs=1, chunk_size=CHUNK_SIZE, median=MEDOID_MEDIAN):
+    """
+    Writes the home location of each user in the gzipped user post files
+    to output_fname, in the order of the files, using jobs processes and
+    the median function named by median.
+
+    The files are read as a stream of chunks of chunk_size users. With
+    jobs > 1, the chunks are parsed and tested by a pool of worker processes,
+    with at most a few chunks per worker in flight, so that memory use does
+    not depend on the size of the files.
+
+    Returns:
+        progress: the Progress counters of the run
+    """
+    progress = Progress()
+    with gzip.open(output_fname, 'wt') as out:
+        def write(homes, num_posts, num_users, num_bytes):
+            for user_id, lat, lon in homes:
+                out.write(f"{user_id}\t{lat}\t{lon}\n")
+            progress.add(num_users, len(homes), num_posts, num_bytes)
+
+        if jobs > 1:
+            print(f"Finding home locations with {jobs} processes")
+            with multiprocessing.Pool(jobs) as pool:
+                in_flight = deque()
+                for lines, num_bytes in user_chunks(users_fnames, chunk_size):
+                    if len(in_flight) >= 4 * jobs:
+                        result, num_users, chunk_bytes = in_flight.popleft()
+                        write(*result.get(), num_users, chunk_bytes)
+                    in_flight.append((pool.apply_async(chunk_home_locations, (lines, median)),
+                                      len(lines), num_bytes))
+                while in_flight:
+                    result, num_users, chunk_bytes = in_flight.popleft()
+                    write(*result.get(), num_users, chunk_bytes)
+        else:
+            for lines, num_bytes in user_chunks(users_fnames, chunk_size):
+                write(*chunk_home_locations(lines, median), len(lines), num_bytes)
+
+    progress.report()
+    print(f"Wrote {progress.located} home locations of {progress.users} users to {output_fname}")
+    return progress
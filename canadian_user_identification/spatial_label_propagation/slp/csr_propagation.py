@@ -0,0 +1,354 @@
+"""
+An array-based engine for spatial label propagation.
+
+The networkit graph is exported once to compressed sparse row (CSR) form, i.e.,
+    indices[indptr[v]:indptr[v+1]]
+holds the neighbours of vertex v, and the current location estimates are kept
+in dense lat/lon arrays indexed by vertex. Each SLP iteration is then a handful
+of array operations instead of a Python loop with a dict lookup per neighbour.
+
+The engine reproduces the dict-based engine in SpatialLabelPropagation exactly,
+including the order in which random numbers are drawn, so both write the same
+user-id-to-location.tsv for the same random seed.
+
+The medians of large neighbourhoods can be computed by a pool of worker
+processes, each handling a contiguous shard of the vertices. The CSR arrays
+and the location arrays are inherited by the forked workers rather than
+pickled for every task, and the location arrays live in shared memory so the
+workers always see the estimates of the previous iteration. All random choices
+are made in the parent process, so the output does not depend on the number
+of workers.
+
+In frontier mode only the users next to an estimate that changed in the
+previous iteration are recomputed, which after the first few iterations is a
+small fraction of the graph, and propagation stops once nothing changes.
+Starting from the estimates of a previous run on a slightly smaller graph,
+few estimates change even in the first iteration, so the frontier shrinks
+right away.
+"""
+
+import ctypes
+import multiprocessing
+import random
+from array import array
+
+import numpy as np
+
+# The number of shards per worker process, so that shards with unusually
+# large neighbourhoods do not leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+# The read-only state of a worker process, set once when the worker starts
+_worker_state = {}
+
+
+def graph_to_csr(G):
+    """
+    Exports the adjacency lists of G to CSR arrays. The neighbours of each
+    vertex are stored in the order networkit iterates them, so that ties in
+    the median are broken the same way as in the dict-based engine.
+
+    Arguments:
+        G: a networkit graph whose vertices are numbered 0..n-1
+
+    Returns:
+        (indptr, indices): int64 arrays of length n+1 and number of edges
+    """
+    n = G.upperNodeIdBound()
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    neighbours = array('q')
+    for vertex in G.iterNodes():
+        start = len(neighbours)
+        neighbours.extend(G.iterNeighbors(vertex))
+        indptr[vertex + 1] = len(neighbours) - start
+    np.cumsum(indptr, out=indptr)
+    indices = np.frombuffer(neighbours, dtype=np.int64).copy()
+    return indptr, indices
+
+
+def gather_rows(indptr, indices, rows):
+    """
+    Returns the CSR arrays of the adjacency lists of the given rows only, so
+    that the i-th gathered list belongs to vertex rows[i].
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    sub_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=sub_indptr[1:])
+
+    # position of each gathered edge within its own adjacency list
+    offsets = np.arange(sub_indptr[-1], dtype=np.int64) - np.repeat(sub_indptr[:-1], lengths)
+    sub_indices = indices[np.repeat(starts, lengths) + offsets]
+    return sub_indptr, sub_indices
+
+
+def located_neighbours(rows, indptr, indices, located):
+    """
+    Finds the located neighbours of each vertex in rows.
+
+    Returns:
+        (counts, first, known): the located neighbours of rows[i] are
+                                known[first[i]:first[i] + counts[i]], in
+                                adjacency list order
+    """
+    sub_indptr, sub_indices = gather_rows(indptr, indices, rows)
+    is_known = located[sub_indices]
+
+    cumulative = np.zeros(len(sub_indices) + 1, dtype=np.int64)
+    np.cumsum(is_known, out=cumulative[1:])
+    first = cumulative[sub_indptr[:-1]]
+    counts = cumulative[sub_indptr[1:]] - first
+    return counts, first, sub_indices[is_known]
+
+
+def propagate_step(rows, indptr, indices, lat, lon, located, median, pool=None, num_shards=1,
+                   user_coins=None):
+    """
+    Computes the next location estimate of every vertex in rows from the
+    current estimates of its neighbours. The current estimates are only read,
+    so the caller decides when to replace them.
+
+    Arguments:
+        rows: the vertices to update, in increasing order
+        lat, lon: the current estimated location of each vertex
+        located: True for each vertex that currently has an estimate
+        median: the function used for neighbourhoods of 3 or more locations
+        pool: if given, the worker pool used to compute those medians
+        num_shards: the number of shards the pool's work is split into
+        user_coins: if given, a fixed 0 or 1 for each vertex, used instead of
+                    a new random pick whenever it has two located neighbours
+
+    Returns:
+        (updated, next_lat, next_lon): the subset of rows with at least one
+                                       located neighbour and their new location
+    """
+    counts, first, known = located_neighbours(rows, indptr, indices, located)
+    next_lat = np.empty(len(rows))
+    next_lon = np.empty(len(rows))
+
+    # A single located neighbour is trivially the median
+    single = np.flatnonzero(counts == 1)
+    picked = known[first[single]]
+    next_lat[single] = lat[picked]
+    next_lon[single] = lon[picked]
+
+    # With two located neighbours get_geometric_median picks one at random.
+    # The coins are drawn in vertex order, which is the order the dict-based
+    # engine draws them in, so both engines consume the same random stream.
+    pairs = np.flatnonzero(counts == 2)
+    if user_coins is None:
+        coins = np.array([random.randint(0, 1) for _ in range(len(pairs))], dtype=np.int64)
+    else:
+        coins = user_coins[rows[pairs]]
+    picked = known[first[pairs] + coins]
+    next_lat[pairs] = lat[picked]
+    next_lon[pairs] = lon[picked]
+
+    # Everything else needs the full median computation
+    large = np.flatnonzero(counts > 2)
+    if pool is None:
+        next_lat[large], next_lon[large] = neighbourhood_medians(rows[large], indptr, indices,
+                                                                 lat, lon, located, median)
+    elif len(large):
+        shards = np.array_split(rows[large], min(len(large), num_shards))
+        results = pool.map(_worker_neighbourhood_medians, shards)
+        next_lat[large] = np.concatenate([shard_lat for shard_lat, _ in results])
+        next_lon[large] = np.concatenate([shard_lon for _, shard_lon in results])
+
+    updated = counts > 0
+    return rows[updated], next_lat[updated], next_lon[updated]
+
+
+def neighbourhood_medians(vertices, indptr, indices, lat, lon, located, median):
+    """
+    Returns the median of the locations of the located neighbours of each of
+    the given vertices, as two arrays of latitudes and longitudes.
+    """
+    counts, first, known = located_neighbours(vertices, indptr, indices, located)
+    medians_lat = np.empty(len(vertices))
+    medians_lon = np.empty(len(vertices))
+    for i in range(len(vertices)):
+        neighbours = known[first[i]:first[i] + counts[i]]
+        coordinates = list(zip(lat[neighbours].tolist(), lon[neighbours].tolist()))
+        medians_lat[i], medians_lon[i] = median(coordinates)[:2]
+    return medians_lat, medians_lon
+
+
+def _init_worker(indptr, indices, lat, lon, located, median):
+    """
+    Stores the arrays shared with the parent process in the worker's state.
+    """
+    _worker_state['indptr'] = indptr
+    _worker_state['indices'] = indices
+    _worker_state['lat'] = np.frombuffer(lat, dtype=np.float64)
+    _worker_state['lon'] = np.frombuffer(lon, dtype=np.float64)
+    _worker_state['located'] = np.frombuffer(located, dtype=np.bool_)
+    _worker_state['median'] = median
+
+
+def _worker_neighbourhood_medians(vertices):
+    """
+    Computes neighbourhood_medians for one shard of vertices in a worker.
+    """
+    return neighbourhood_medians(vertices, _worker_state['indptr'],
+                                 _worker_state['indices'], _worker_state['lat'],
+                                 _worker_state['lon'], _worker_state['located'],
+                                 _worker_state['median'])
+
+
+def shared_array(ctype, n):
+    """
+    Allocates a zeroed array of n items in memory shared with forked worker
+    processes, returning both the raw buffer and a NumPy view of it.
+    """
+    raw = multiprocessing.RawArray(ctype, n)
+    return raw, np.frombuffer(raw, dtype=np.dtype(ctype))
+
+
+def propagate_csr(G, home_lat, home_lon, is_home, num_iterations, median, workers=1,
+                  frontier=False, initial=None, touched=None):
+    """
+    Runs spatial label propagation over the CSR export of G.
+
+    Arguments:
+        G: the bi-directional networkit graph
+        home_lat, home_lon: the gold-standard location of each vertex
+        is_home: True for each vertex with a gold-standard location
+        num_iterations: the number of SLP iterations to run
+        median: the function used to combine 3 or more neighbour locations
+        workers: the number of processes used to compute the medians
+        frontier: if True, only recompute the users with a neighbour whose
+                  estimate changed in the previous iteration, and stop as soon
+                  as no estimate changes or the estimates alternate between
+                  two states. To make this possible, each user tosses its
+                  coin for choosing between two located neighbours only once,
+                  so the output can differ from a full run.
+        initial: if given, the (lat, lon, has_location) arrays of the location
+                 of each vertex estimated by a previous run, used as the
+                 starting estimates of the vertices without a gold-standard
+                 location
+        touched: with initial in frontier mode, the vertices whose adjacency
+                 list changed since the previous run, if known. The first
+                 iteration then only recomputes these vertices and the
+                 neighbours of these vertices and of the gold-standard
+                 vertices whose location differs from their starting
+                 estimate, instead of every vertex
+
+    Returns:
+        (located, lat, lon): the vertices without a gold-standard location
+                             that have an estimate, in the order they were
+                             located (which matches the dict-based engine),
+                             after those with a starting estimate, and the
+                             final lat/lon arrays indexed by vertex
+    """
+    print('Exporting network to CSR arrays')
+    indptr, indices = graph_to_csr(G)
+    num_vertices = len(indptr) - 1
+
+    lat_buffer, lat = shared_array(ctypes.c_double, num_vertices)
+    lon_buffer, lon = shared_array(ctypes.c_double, num_vertices)
+    located_buffer, located = shared_array(ctypes.c_bool, num_vertices)
+    is_home = np.asarray(is_home, dtype=bool)
+    if initial is not None:
+        initial_lat, initial_lon, has_initial = initial
+        lat[:] = initial_lat
+        lon[:] = initial_lon
+        located[:] = has_initial
+    lat[is_home] = home_lat[is_home]
+    lon[is_home] = home_lon[is_home]
+    located[is_home] = True
+    if initial is not None:
+        print('Starting from the previous estimates of %s users'
+                    % np.count_nonzero(located & ~is_home))
+
+    # Users with a gold-standard location never move, so only the rest of the
+    # vertices are ever recomputed. In frontier mode, rows is narrowed down to
+    # the users next to a changed estimate after each iteration.
+    rows = np.flatnonzero(~is_home)
+    if frontier and initial is not None and touched is not None:
+        # The other vertices have the same neighbours with the same
+        # estimates as in the previous run, so they cannot change at first
+        moved_home = is_home & (~has_initial | (initial_lat != home_lat) | (initial_lon != home_lon))
+        sources = np.union1d(touched, np.flatnonzero(moved_home))
+        _, neighbours = gather_rows(indptr, indices, sources)
+        rows = np.union1d(touched, neighbours)
+        rows = rows[~is_home[rows]]
+        print('Starting from a frontier of %s users next to %s changed users'
+                    % (len(rows), len(sources)))
+
+    pool = None
+    if workers > 1:
+        print('Starting %d worker processes' % workers)
+        pool = multiprocessing.get_context('fork').Pool(
+            workers, initializer=_init_worker,
+            initargs=(indptr, indices, lat_buffer, lon_buffer, located_buffer, median))
+
+    # The vertices located for the first time in each iteration, in order,
+    # after the vertices with a starting estimate
+    newly_located = [np.flatnonzero(located & ~is_home)]
+
+    user_coins = None
+    if frontier:
+        user_coins = np.random.default_rng(random.getrandbits(64)).integers(0, 2, num_vertices)
+
+    # In frontier mode, the users whose estimate changed in the previous
+    # iteration and their estimate before the change
+    last_changed = None
+    try:
+        for iteration in range(0, num_iterations):
+            if frontier:
+                print('Beginning iteration %s with a frontier of %s users' % (iteration, len(rows)))
+            else:
+                print('Beginning iteration %s' % iteration)
+            updated, next_lat, next_lon = propagate_step(rows, indptr, indices,
+                                                         lat, lon, located, median,
+                                                         pool, workers * SHARDS_PER_WORKER,
+                                                         user_coins)
+            new = updated[~located[updated]]
+            newly_located.append(new)
+            moved = (lat[updated] != next_lat) | (lon[updated] != next_lon)
+            changed = updated[moved | ~located[updated]]
+            changed_lat = lat[changed]
+            changed_lon = lon[changed]
+
+            # Replace all the old location estimates with what we estimated
+            # from this iteration. The workers are idle at this point, so the
+            # shared arrays can be written in place.
+            lat[updated] = next_lat
+            lon[updated] = next_lon
+            located[updated] = True
+            print('At end of iteration %s, located %s users (%s new, %s changed)' %
+                         (iteration, np.count_nonzero(located), len(new), len(changed)))
+
+            if frontier:
+                # Only the neighbours of a changed estimate can change next
+                _, neighbours = gather_rows(indptr, indices, changed)
+                rows = np.unique(neighbours)
+                rows = rows[~is_home[rows]]
+                if len(rows) == 0:
+                    print('Converged after %s iterations' % (iteration + 1))
+                    break
+
+                # Synchronous updates often end with pairs of users swapping
+                # estimates forever. With fixed coins an iteration is a
+                # function of the previous estimates, so if this iteration
+                # undid exactly the changes of the previous one, the estimates
+                # will keep alternating between the last two states.
+                if (last_changed is not None and len(new) == 0
+                        and np.array_equal(changed, last_changed[0])
+                        and np.array_equal(lat[changed], last_changed[1])
+                        and np.array_equal(lon[changed], last_changed[2])):
+                    print('Estimates of %s users alternate between two states after %s iterations'
+                                % (len(changed), iteration + 1))
+                    if (num_iterations - 1 - iteration) % 2 == 1:
+                        # the remaining iterations end in the other state
+                        lat[changed] = changed_lat
+                        lon[changed] = changed_lon
+                    break
+                last_changed = (changed, changed_lat, changed_lon)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return np.concatenate(newly_located), lat, lon
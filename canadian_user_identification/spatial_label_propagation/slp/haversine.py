@@ -0,0 +1,59 @@
+"""
+Great circle (haversine) distances with NumPy, shared by median.py,
+home_location.py and geolocate_users.py.
+
+    haversine: the distances between pairs of locations, element-wise
+    haversine_matrix: the distances between every location of one list and
+                every location of another
+    distance_sums: the sum of the distances from each location to all the
+                locations, from a distance matrix built in blocks
+"""
+
+import numpy as np
+
+# Mean radius of the Earth in km
+EARTH_RADIUS = 6371.0088
+
+# The largest number of entries in a block of the pairwise distance matrix, so
+# that n locations need O(n) rather than O(n^2) memory
+MAX_BLOCK_SIZE = 2 ** 22
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Returns the great circle distances in km between the locations
+    (lat1[i], lon1[i]) and (lat2[i], lon2[i]), in degrees. The arrays are
+    broadcast against each other.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    Returns the matrix of great circle distances in km between every location
+    (lat1[i], lon1[i]) and every location (lat2[j], lon2[j]), in degrees.
+    """
+    lat1 = np.asarray(lat1)[:, np.newaxis]
+    lon1 = np.asarray(lon1)[:, np.newaxis]
+    lat2 = np.asarray(lat2)[np.newaxis, :]
+    lon2 = np.asarray(lon2)[np.newaxis, :]
+    return haversine(lat1, lon1, lat2, lon2)
+
+
+def distance_sums(lats, lons, block_size=MAX_BLOCK_SIZE):
+    """
+    Returns, for each location, the sum of its great circle distances to all
+    the locations. The distance matrix is computed a block of rows at a time,
+    so that it never holds more than block_size distances.
+    """
+    n = len(lats)
+    rows_per_block = max(1, block_size // n)
+    sums = np.empty(n)
+    for start in range(0, n, rows_per_block):
+        end = min(n, start + rows_per_block)
+        block = haversine_matrix(lats[start:end], lons[start:end], lats, lons)
+        sums[start:end] = block.sum(axis=1)
+    return sums
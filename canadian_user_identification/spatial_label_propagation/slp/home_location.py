@@ -0,0 +1,143 @@
+"""
+Finds out whether a user's GPS locations contain a group of locations that
+are all close to each other, the test has_home in spatial_label_propagation.py
+applies before assigning a user a home location.
+
+The question is whether the graph linking every two locations at most radius
+km apart contains a clique of the given size. The exhaustive search in
+has_home_exhaustive tries every subset of locations and computes the geodesic
+distance of each pair it looks at with geopy, which is exponential in the
+worst case. Here:
+
+    - The locations are sorted by latitude, so that the candidate neighbours
+      of a location are a contiguous window of locations whose latitude is
+      close enough, and the great circle (haversine) distances to them are
+      computed as one array operation.
+    - Haversine and geodesic distances differ by well under HAVERSINE_MARGIN,
+      so only pairs whose haversine distance is within that margin of the
+      radius are decided with the exact distance function, and the answer is
+      the same as with the exact distance for every pair.
+    - A clique is found from its first location in latitude order, among the
+      later neighbours of that location. If enough of them are within half
+      the radius of it, they form a clique by the triangle inequality;
+      otherwise a depth-bounded search runs over bitsets of the adjacency
+      between those neighbours.
+
+In the plane, the neighbours of a location with no clique of 5 fit in six
+60 degree sectors of at most 3 locations each, so the neighbourhoods searched
+stay small unless a clique is found quickly.
+"""
+
+import numpy as np
+
+from slp.haversine import EARTH_RADIUS, haversine
+
+# Haversine distances on a sphere of radius EARTH_RADIUS are within 0.6% of
+# geodesic distances on the WGS-84 ellipsoid, so pairs whose haversine distance
+# is within this relative margin of the radius are checked with the exact
+# distance function
+HAVERSINE_MARGIN = 0.01
+
+# The largest number of location pairs compared in one array operation
+MAX_BLOCK_SIZE = 2 ** 20
+
+
+def within_radius(lats, lons, first, second, radius, exact_distance):
+    """
+    Returns, for each pair of locations (first[i], second[i]), whether they
+    are at most radius km apart according to exact_distance, which is only
+    called for the pairs that the haversine distance cannot decide.
+    """
+    distances = haversine(lats[first], lons[first], lats[second], lons[second])
+    close = distances <= radius * (1 - HAVERSINE_MARGIN)
+    unsure = np.flatnonzero((distances <= radius * (1 + HAVERSINE_MARGIN)) & ~close)
+    for k in unsure.tolist():
+        close[k] = exact_distance(int(first[k]), int(second[k])) <= radius
+    return close
+
+
+def has_clique(neighbours, candidates, size):
+    """
+    Returns True if the vertices in the bitset candidates contain a clique of
+    the given size, where neighbours[v] is the bitset of the neighbours of v.
+    """
+    if size == 0:
+        return True
+    while bin(candidates).count('1') >= size:
+        v = (candidates & -candidates).bit_length() - 1
+        candidates &= ~(1 << v)
+        if has_clique(neighbours, candidates & neighbours[v], size - 1):
+            return True
+    return False
+
+
+def has_close_group(lats, lons, size, radius, exact_distance):
+    """
+    Returns True if at least size of the given locations are all at most
+    radius km from each other.
+
+    Arguments:
+        lats, lons: the locations, in degrees
+        size: the number of locations in the group
+        radius: the largest distance between two locations of the group, in km
+        exact_distance: a function returning the distance in km between the
+                        locations with the given indices, used to decide the
+                        pairs close to the radius
+
+    Returns:
+        True if such a group exists
+    """
+    n = len(lats)
+    if n < size:
+        return False
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    # The same location repeated size times is a group, which is the common
+    # case for users who tweet from home
+    _, counts = np.unique(np.column_stack((lats, lons)), axis=0, return_counts=True)
+    if counts.max() >= size:
+        return True
+
+    # A great circle is at least as long as its change in latitude, so only
+    # the locations in a window of latitudes can be within the radius
+    order = np.argsort(lats, kind='stable')
+    window = np.degrees(radius * (1 + HAVERSINE_MARGIN) / EARTH_RADIUS)
+    ends = np.searchsorted(lats[order], lats[order] + window, side='right')
+
+    for position in range(n - size + 1):
+        later = order[position + 1:ends[position]]
+        if len(later) < size - 1:
+            continue
+        first = np.full(len(later), order[position])
+        later = later[within_radius(lats, lons, first, later, radius, exact_distance)]
+        if len(later) < size - 1:
+            continue
+
+        # Locations within half the radius of the same location are within
+        # the radius of each other, which settles most dense neighbourhoods
+        # without comparing every pair
+        half = haversine(lats[first[:len(later)]], lons[first[:len(later)]], lats[later], lons[later])
+        if np.count_nonzero(half <= radius / 2 * (1 - HAVERSINE_MARGIN)) >= size - 1:
+            return True
+
+        # Adjacency between the close later locations, computed a block of
+        # rows at a time and stored as one bitset per location
+        d = len(later)
+        adjacent = np.zeros((d, d), dtype=bool)
+        rows_per_block = max(1, MAX_BLOCK_SIZE // d)
+        for start in range(0, d, rows_per_block):
+            end = min(d, start + rows_per_block)
+            rows = np.repeat(later[start:end], d)
+            cols = np.tile(later, end - start)
+            adjacent[start:end] = within_radius(lats, lons, rows, cols, radius,
+                                                exact_distance).reshape(end - start, d)
+        # keep one decision per pair, even if the exact distance is not
+        # exactly symmetric
+        adjacent = np.triu(adjacent, 1)
+        adjacent |= adjacent.T
+        packed = np.packbits(adjacent, axis=1, bitorder='little')
+        neighbours = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        if has_clique(neighbours, (1 << d) - 1, size - 1):
+            return True
+    return False
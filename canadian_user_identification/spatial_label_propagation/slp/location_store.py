@@ -0,0 +1,244 @@
+"""
+A binary, memory-mappable store for the vertex-to-user map and the
+gold-standard home locations of a dataset.
+
+Reading vertex_to_userID.csv with the csv module and decoding the gzipped home
+location TSV line by line takes minutes on large datasets. Instead, the
+dataset directory can hold NumPy .npy files that np.load maps into memory
+without reading or copying them:
+
+    ds_root/
+        vertex_user_ids.npy: int64, the user ID of each vertex
+        touched_user_ids.npy: int64, the users whose bidirectional edges
+                              changed in the last --update, if the dataset
+                              was updated (see load_touched_user_ids)
+        home_locations/
+            lat.npy, lon.npy: float64, the home location of each row
+            has_location.npy: bool, True for the rows with a home location
+            extra_user_ids.npy: int64, the user IDs of the rows after the
+                                vertices, i.e., of the users with a home
+                                location who are not in the graph
+            order.npy: int64, the rows with a home location, in the order of
+                       the location file
+            source.json: the location file and vertex map the store was
+                         built from, to detect a stale store
+
+Row v < num_vertices of the home locations belongs to vertex v. New datasets
+write vertex_user_ids.npy as they are built. Older datasets, and the home
+locations of any location file, are converted once with
+
+    python3 -m slp.app convert_dataset dataset_dir location_file
+"""
+
+import csv
+import gzip
+import json
+import os, os.path
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+VERTEX_USER_IDS = 'vertex_user_ids.npy'
+TOUCHED_USER_IDS = 'touched_user_ids.npy'
+HOME_LOCATIONS = 'home_locations'
+
+HomeLocations = namedtuple('HomeLocations',
+                           ['lat', 'lon', 'has_location', 'extra_user_ids', 'order'])
+
+
+def write_vertex_user_ids(dataset_dir, user_ids):
+    """
+    Writes the user ID of each vertex to vertex_user_ids.npy in dataset_dir.
+    """
+    np.save(os.path.join(dataset_dir, VERTEX_USER_IDS), np.asarray(user_ids, dtype=np.int64))
+
+
+def read_vertex_map_csv(dataset_dir):
+    """
+    Returns the int64 array of the user IDs in vertex_to_userID.csv, in
+    vertex order.
+    """
+    vertex_to_userID = array('q')
+    with open(os.path.join(dataset_dir, 'vertex_to_userID.csv'), "r") as f:
+        reader = csv.reader(f)
+        for row in reader:
+            vertex_to_userID.append(int(row[1]))
+    return np.frombuffer(vertex_to_userID, dtype=np.int64)
+
+
+def load_vertex_user_ids(dataset_dir):
+    """
+    Returns the int64 array of the user ID of each vertex, memory-mapped from
+    vertex_user_ids.npy, or None if the dataset has no such file.
+    """
+    path = os.path.join(dataset_dir, VERTEX_USER_IDS)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def write_touched_user_ids(dataset_dir, user_ids):
+    """
+    Writes the user IDs whose bidirectional edges changed in an update of
+    the dataset to touched_user_ids.npy in dataset_dir, or, if user_ids is
+    None (a full build), removes the file of an earlier update.
+    """
+    path = os.path.join(dataset_dir, TOUCHED_USER_IDS)
+    if user_ids is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    np.save(path, np.asarray(user_ids, dtype=np.int64))
+
+
+def load_touched_user_ids(dataset_dir):
+    """
+    Returns the int64 array of the users whose bidirectional edges changed
+    in the last update of the dataset, or None if the dataset was built from
+    scratch (or before updates recorded them).
+    """
+    path = os.path.join(dataset_dir, TOUCHED_USER_IDS)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+def find_vertices(vertex_user_ids, user_ids):
+    """
+    Returns the vertex of each of the given user IDs, or -1 for the users who
+    are not in the graph.
+    """
+    num_vertices = len(vertex_user_ids)
+    vertices = np.full(len(user_ids), -1, dtype=np.int64)
+    if num_vertices == 0:
+        return vertices
+    sorter = np.argsort(vertex_user_ids, kind='stable')
+    sorted_ids = np.asarray(vertex_user_ids)[sorter]
+    positions = np.minimum(np.searchsorted(sorted_ids, user_ids), num_vertices - 1)
+    in_graph = sorted_ids[positions] == user_ids
+    vertices[in_graph] = sorter[positions[in_graph]]
+    return vertices
+
+
+def read_home_locations(location_file, vertex_user_ids):
+    """
+    Reads the gzipped USER_ID\tLAT\tLON file into the rows of a HomeLocations.
+    If a user appears more than once, the last location is used, at the
+    position of the first.
+    """
+    user_to_home_loc = {}
+    with gzip.open(location_file, 'rt') as fh:
+        for line in fh:
+            user_id, lat, lon = line.split('\t')
+            user_to_home_loc[int(user_id)] = (float(lat), float(lon))
+
+    num_vertices = len(vertex_user_ids)
+    user_ids = np.fromiter(user_to_home_loc.keys(), dtype=np.int64, count=len(user_to_home_loc))
+    locations = np.array(list(user_to_home_loc.values()), dtype=np.float64).reshape(-1, 2)
+
+    rows = find_vertices(vertex_user_ids, user_ids)
+    in_graph = rows >= 0
+    rows[~in_graph] = num_vertices + np.arange(np.count_nonzero(~in_graph))
+    extra_user_ids = user_ids[~in_graph]
+
+    num_rows = num_vertices + len(extra_user_ids)
+    lat = np.zeros(num_rows)
+    lon = np.zeros(num_rows)
+    has_location = np.zeros(num_rows, dtype=bool)
+    lat[rows] = locations[:, 0]
+    lon[rows] = locations[:, 1]
+    has_location[rows] = True
+    return HomeLocations(lat, lon, has_location, extra_user_ids, rows)
+
+
+def vertex_locations(user_to_location, vertex_user_ids):
+    """
+    Looks up the location of each vertex in a dict keyed by integer user ID.
+
+    Returns:
+        (lat, lon, has_location): arrays indexed by vertex
+    """
+    num_vertices = len(vertex_user_ids)
+    user_ids = np.fromiter(user_to_location.keys(), dtype=np.int64, count=len(user_to_location))
+    locations = np.array(list(user_to_location.values()), dtype=np.float64).reshape(-1, 2)
+    vertices = find_vertices(vertex_user_ids, user_ids)
+    in_graph = vertices >= 0
+
+    lat = np.zeros(num_vertices)
+    lon = np.zeros(num_vertices)
+    has_location = np.zeros(num_vertices, dtype=bool)
+    lat[vertices[in_graph]] = locations[in_graph, 0]
+    lon[vertices[in_graph]] = locations[in_graph, 1]
+    has_location[vertices[in_graph]] = True
+    return lat, lon, has_location
+
+
+def row_user_ids(vertex_user_ids, home):
+    """
+    Returns the user ID of each row of the HomeLocations home, i.e., the user
+    IDs of the vertices followed by those of the extra rows.
+    """
+    return np.concatenate([vertex_user_ids, home.extra_user_ids])
+
+
+def _fingerprint(path):
+    """
+    Identifies the current version of a file by its path, size and mtime.
+    """
+    stat = os.stat(path)
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _source(dataset_dir, location_file):
+    return {"location_file": _fingerprint(location_file),
+            "vertex_user_ids": _fingerprint(os.path.join(dataset_dir, VERTEX_USER_IDS))}
+
+
+def save_home_locations(dataset_dir, location_file, home):
+    """
+    Writes the HomeLocations read from location_file to the store in
+    dataset_dir, replacing any previous one.
+    """
+    store_dir = os.path.join(dataset_dir, HOME_LOCATIONS)
+    if not os.path.exists(store_dir):
+        os.mkdir(store_dir)
+    for field in HomeLocations._fields:
+        np.save(os.path.join(store_dir, field + '.npy'), getattr(home, field))
+    with open(os.path.join(store_dir, 'source.json'), 'w') as f:
+        json.dump(_source(dataset_dir, location_file), f, indent=4)
+
+
+def load_home_locations(dataset_dir, location_file):
+    """
+    Returns the HomeLocations of location_file, memory-mapped from the store
+    in dataset_dir, or None if there is no store or it was built from a
+    different location file or vertex map.
+    """
+    store_dir = os.path.join(dataset_dir, HOME_LOCATIONS)
+    source_path = os.path.join(store_dir, 'source.json')
+    if not os.path.exists(source_path) or load_vertex_user_ids(dataset_dir) is None:
+        return None
+    with open(source_path, 'r') as f:
+        if json.load(f) != _source(dataset_dir, location_file):
+            print('The home locations in %s are out of date, ignoring them' % store_dir)
+            return None
+    return HomeLocations(*[np.load(os.path.join(store_dir, field + '.npy'), mmap_mode='r')
+                           for field in HomeLocations._fields])
+
+
+def convert_dataset(dataset_dir, location_file):
+    """
+    Converts the vertex_to_userID.csv of dataset_dir to vertex_user_ids.npy,
+    if needed, and the home locations in location_file to the store.
+    """
+    if load_vertex_user_ids(dataset_dir) is None:
+        print('Converting the vertex map of %s' % dataset_dir)
+        write_vertex_user_ids(dataset_dir, read_vertex_map_csv(dataset_dir))
+    vertex_user_ids = load_vertex_user_ids(dataset_dir)
+
+    print('Converting the home locations in %s' % location_file)
+    home = read_home_locations(location_file, vertex_user_ids)
+    save_home_locations(dataset_dir, location_file, home)
+    print('Stored %d home locations, %d of them of users in the graph'
+          % (len(home.order), len(home.order) - len(home.extra_user_ids)))
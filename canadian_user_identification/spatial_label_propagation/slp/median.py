@@ -0,0 +1,107 @@
+"""
+Vectorized alternatives to get_geometric_median in spatial_label_propagation.py.
+
+get_geometric_median compares every pair of points with geopy's geodesic
+distance, one Python call per pair. The functions here take the same list of
+(lat, lon) locations and return a (lat, lon) tuple, but do the distance work
+with NumPy on the haversine (great circle) distance:
+
+    get_medoid: the location that minimizes the summed distance to all the
+                other locations, i.e., the same quantity get_geometric_median
+                computes, from a pairwise distance matrix built in chunks
+    get_weiszfeld_median: an approximate geometric median on the sphere using
+                Weiszfeld's algorithm. Unlike the medoid, the result need not
+                be one of the input locations.
+
+As in get_geometric_median, a single location is returned as is and one of two
+locations is picked at random.
+"""
+
+import random
+
+import numpy as np
+
+from slp.haversine import distance_sums
+
+
+def get_medoid(coordinates):
+    """
+    Returns the location in the list that minimizes the sum of the great
+    circle distances to all other locations.
+    """
+    n = len(coordinates)
+    if n == 1:
+        return coordinates[0]
+    elif n == 2:
+        return coordinates[random.randint(0, 1)]
+
+    points = np.asarray(coordinates, dtype=np.float64)[:, :2]
+    sums = distance_sums(points[:, 0], points[:, 1])
+
+    # argmin returns the first minimum, which is the point the loop in
+    # get_geometric_median keeps when there are ties
+    return coordinates[int(np.argmin(sums))]
+
+
+def get_weiszfeld_median(coordinates, max_iterations=50, tolerance=1e-6):
+    """
+    Returns an approximation of the geometric median of the list of locations,
+    i.e., the point on the sphere minimizing the sum of great circle distances
+    to all of them.
+
+    Each location is mapped to a unit vector, and the estimate is repeatedly
+    replaced by the average of the vectors weighted by their inverse distance
+    to it, projected back onto the sphere. The search starts from the
+    normalized centroid and stops once an iteration moves the estimate by less
+    than tolerance radians (1e-6 radians is about 6 m).
+    """
+    n = len(coordinates)
+    if n == 1:
+        return coordinates[0]
+    elif n == 2:
+        return coordinates[random.randint(0, 1)]
+
+    points = np.radians(np.asarray(coordinates, dtype=np.float64)[:, :2])
+    cos_lat = np.cos(points[:, 0])
+    vectors = np.column_stack((cos_lat * np.cos(points[:, 1]),
+                               cos_lat * np.sin(points[:, 1]),
+                               np.sin(points[:, 0])))
+
+    # For small neighbourhoods the median is often one of the locations, which
+    # Weiszfeld's algorithm only approaches slowly. A location is the median
+    # if the unit vectors pointing from it to the other locations, projected
+    # onto the tangent plane, sum to no more than the number of locations
+    # stacked on it (the Kuhn optimality condition), so test the medoid first.
+    medoid = int(np.argmin(distance_sums(np.degrees(points[:, 0]), np.degrees(points[:, 1]))))
+    offsets = vectors - vectors[medoid]
+    lengths = np.linalg.norm(offsets, axis=1)
+    apart = lengths > tolerance
+    pull = (offsets[apart] / lengths[apart, np.newaxis]).sum(axis=0)
+    pull -= (pull @ vectors[medoid]) * vectors[medoid]
+    if np.linalg.norm(pull) <= n - np.count_nonzero(apart):
+        return coordinates[medoid]
+
+    estimate = vectors.sum(axis=0)
+    norm = np.linalg.norm(estimate)
+    if norm < tolerance:
+        # The locations are spread evenly around the globe, so the direction
+        # of the centroid is meaningless; fall back to the medoid
+        return coordinates[medoid]
+    estimate /= norm
+
+    for _ in range(max_iterations):
+        # angular distance from the estimate to each location, bounded away
+        # from zero so a location at the estimate does not get infinite weight
+        angles = np.arccos(np.clip(vectors @ estimate, -1, 1))
+        weights = 1 / np.maximum(angles, tolerance)
+
+        new_estimate = weights @ vectors
+        new_estimate /= np.linalg.norm(new_estimate)
+        moved = np.arccos(np.clip(new_estimate @ estimate, -1, 1))
+        estimate = new_estimate
+        if moved < tolerance:
+            break
+
+    lat = np.degrees(np.arcsin(np.clip(estimate[2], -1, 1)))
+    lon = np.degrees(np.arctan2(estimate[1], estimate[0]))
+    return (float(lat), float(lon))
@@ -4,7 +4,13 @@ Contains useful definitions and variables for interfacing with a settings file.
 The following configuration variables can be set in a json file:
 {
     "num_iterations" : INT,
-    "location_source" : STRING
+    "location_source" : STRING,
+    "engine" : STRING,
+    "median" : STRING,
+    "random_seed" : INT,
+    "workers" : INT,
+    "frontier" : BOOL,
+    "warm_start" : STRING
 }
 
 where
@@ -12,7 +18,56 @@ where
     location_source is the name of a tsv.gz file mapping each user
                     ID to their lat and lon coordinates, i.e.,
                                 USER_ID\tLAT\tLON
+    engine is either "python" (the default), which updates one user at a
+           time using dicts keyed by user ID, or "csr", which exports the
+           graph to CSR arrays once and runs each iteration as array
+           operations. Both engines produce the same output.
+    median is the function used to estimate a user's location from the
+           locations of their neighbours:
+               "geopy" (the default): the location with the smallest sum of
+                        geodesic distances to the others, computed with geopy
+               "medoid": the same, using a NumPy haversine distance matrix
+               "weiszfeld": an approximate geometric median on the sphere,
+                        which need not be one of the neighbour locations
+    random_seed seeds Python's random number generator before training, so
+           that the random choice between two equally good neighbour
+           locations is repeatable
+    workers is the number of processes used to compute the medians of large
+           neighbourhoods (default 1). More than one worker requires the csr
+           engine, which is used automatically. Can also be set with the
+           --workers option of slp.app train.
+    frontier, if true, recomputes only the users with a neighbour whose
+           estimate changed in the previous iteration, and stops before
+           num_iterations once no estimate changes (or the estimates only
+           alternate between two states). Each user picks between two
+           located neighbours with a coin tossed once rather than in every
+           iteration, so the output can differ slightly from a full run.
+           Requires the csr engine, which is used automatically.
+    warm_start is the directory of a previously trained model. The users in
+           its user-id-to-location.tsv start from their estimated location
+           instead of having none, and frontier mode is used, so that only
+           the neighbourhoods that changed since the previous run (e.g.,
+           because the graph grew) are propagated again after the first
+           iteration. Can also be set with the --warm-start option of
+           slp.app train.
 """
 
 NUM_ITERATIONS = "num_iterations"
 LOCATION_SOURCE = "location_source"
+ENGINE = "engine"
+
+# Values for the ENGINE setting
+PYTHON_ENGINE = "python"
+CSR_ENGINE = "csr"
+
+MEDIAN = "median"
+
+# Values for the MEDIAN setting
+GEOPY_MEDIAN = "geopy"
+MEDOID_MEDIAN = "medoid"
+WEISZFELD_MEDIAN = "weiszfeld"
+
+RANDOM_SEED = "random_seed"
+WORKERS = "workers"
+FRONTIER = "frontier"
+WARM_START = "warm_start"
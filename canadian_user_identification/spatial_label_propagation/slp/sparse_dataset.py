@@ -7,13 +7,19 @@
 A geoinference dataset is stored on disk in a directory with the following format:
     ds_root/
         saved_graph.gt
+        users.json.gz: optional, the posts of each user, one JSON object per
+                       line (see slp/build_home_locations.py)
 """
 
 import json
 import os, os.path, sys, csv
 import gzip
 import networkit as nk
+import numpy as np
 from slp.settings import LOCATION_SOURCE
+from slp.location_store import load_vertex_user_ids, read_vertex_map_csv, load_touched_user_ids
+from slp.location_store import load_home_locations, read_home_locations
+from slp.build_home_locations import load_user
 
 
 class SparseDataset(object):
@@ -34,6 +40,7 @@ class SparseDataset(object):
             self._location_file = default_location_source
 
         self._network_fname = os.path.join(dataset_dir, 'saved_graph.gt')
+        self._users_fname = os.path.join(dataset_dir, 'users.json.gz')
 
 
     def post_iter(self):
@@ -49,6 +56,13 @@ class SparseDataset(object):
                 yield post
         fh.close()
 
+    def load_user(self, line):
+        """
+        Parses one line of the users file into a dict with the fields
+        user_id and posts.
+        """
+        return load_user(line)
+
     def __iter__(self):
         """
         Return an iterator over all the posts in the dataset.
@@ -65,7 +79,7 @@ class SparseDataset(object):
             fh = gzip.open(self._location_file)
             for line in fh:
                 user_id, lat, lon = line.decode().split('\t')
-                yield (user_id, (float(lat), float(lon)))
+                yield (int(user_id), (float(lat), float(lon)))
             fh.close()
 
 
@@ -80,23 +94,53 @@ class SparseDataset(object):
             yield user
         fh.close()
 
-    def build_graph(self):
+    def load_graph(self):
+        """
+        Returns the networkit graph of the dataset.
+        """
         fname = os.path.join(self._dataset_dir, 'saved_graph.gt')
         print("Loading graph from:", fname)
         G = nk.readGraph(fname, nk.Format.GraphToolBinary)
         if not G.checkConsistency():
             raise Exception("The constructed graph is inconsistent. Something went wrong! Please fix this error and try again.")
         print("Successfully loaded graph.")
+        return G
 
-        vertex_path = os.path.join(self._dataset_dir, 'vertex_to_userID.csv')
-        print("Loading vertices from:", vertex_path)
-        vertex_to_userID = []
-        with open(vertex_path, "r") as f:
-            reader = csv.reader(f)
-            # saving the graph will condense the vertex IDs, so make sure
-            # to save the condensed IDs (ranging from 0 to numNodes-1) accordingly
-            for row in reader:
-                vertex_to_userID.append(str(row[1]))
+    def vertex_user_ids(self):
+        """
+        Returns the int64 array of the user ID of each vertex, memory-mapped
+        from the binary vertex map if the dataset has one.
+        """
+        user_ids = load_vertex_user_ids(self._dataset_dir)
+        if user_ids is None:
+            print("Loading vertices from:", os.path.join(self._dataset_dir, 'vertex_to_userID.csv'))
+            user_ids = read_vertex_map_csv(self._dataset_dir)
+        return user_ids
 
+    def touched_user_ids(self):
+        """
+        Returns the int64 array of the users whose bidirectional edges changed
+        in the last --update of the dataset, or None if it was not updated.
+        """
+        return load_touched_user_ids(self._dataset_dir)
+
+    def home_locations(self, vertex_user_ids):
+        """
+        Returns the HomeLocations of the users in the location file, see
+        slp/location_store.py, memory-mapped from the binary store if the
+        dataset has an up-to-date one.
+        """
+        home = load_home_locations(self._dataset_dir, self._location_file)
+        if home is None:
+            print('Loading home locations from %s' % self._location_file)
+            home = read_home_locations(self._location_file, vertex_user_ids)
+        return home
+
+    def build_graph(self):
+        """
+        Returns the graph and the int64 array of the user ID of each vertex.
+        """
+        G = self.load_graph()
+        vertex_to_userID = self.vertex_user_ids()
         print("Successfully loaded vertex to user map.")
         return G, vertex_to_userID
@@ -9,7 +9,13 @@ Can create a settings.json file with the following fields:
 
 {
     "num_iterations" : INT,
-    "location_source" : STRING
+    "location_source" : STRING,
+    "engine" : STRING,
+    "median" : STRING,
+    "random_seed" : INT,
+    "workers" : INT,
+    "frontier" : BOOL,
+    "warm_start" : STRING
 }
 
 where
@@ -17,23 +23,43 @@ where
     location_source is the name of a tsv.gz file mapping each user
                     ID to their lat and lon coordinates, i.e.,
                                 USER_ID\tLAT\tLON
+    engine is "python" (default) or "csr", see slp/settings.py
+    median is "geopy" (default), "medoid" or "weiszfeld", see slp/settings.py
+    random_seed seeds the random choice between two neighbour locations
+    workers is the number of processes used by the csr engine (default 1)
+    frontier, if true, only recomputes users whose neighbourhood changed
+    warm_start is a model directory whose estimated locations are the
+               starting point, see slp/settings.py
 """
 
 import random
-from geopy.point import Point
 from geopy import distance
 import os.path
 import itertools
 import gzip
 import sys
 
-from slp.settings import LOCATION_SOURCE, NUM_ITERATIONS
+from slp.settings import LOCATION_SOURCE, NUM_ITERATIONS, ENGINE, PYTHON_ENGINE, CSR_ENGINE
+from slp.settings import MEDIAN, GEOPY_MEDIAN, MEDOID_MEDIAN, WEISZFELD_MEDIAN
+from slp.settings import RANDOM_SEED, WORKERS, FRONTIER, WARM_START
+from slp.csr_propagation import propagate_csr
+from slp.location_store import vertex_locations, row_user_ids, find_vertices
+from slp.home_location import has_close_group
+from slp.median import get_medoid, get_weiszfeld_median
 
 time_per_infer_user = 0
 num_users_inferred = 0
 time_per_geometric_median = 0
 num_geometric_median = 0
 
+def user_locations(row_user_ids, row_to_location):
+    """
+    Returns the locations in row_to_location keyed by the integer user ID of
+    each row instead, in the same order.
+    """
+    row_user_ids = row_user_ids.tolist()
+    return {row_user_ids[row]: loc for row, loc in row_to_location.items()}
+
 class SpatialLabelPropagationModel:
 
     def __init__(self, user_id_to_location):
@@ -83,6 +109,7 @@ class SpatialLabelPropagation:
             print("Loaded settings:", self._settings)
         else:
             self._settings = dict()
+        self._median = get_median_function(self._settings.get(MEDIAN, GEOPY_MEDIAN))
 
     def train_model(self, setting, dataset, model_dir):
         """
@@ -92,65 +119,124 @@ class SpatialLabelPropagation:
         within 15km of each other.
         """
 
+        # TODO: make this configurable from the settings varaible
+        if NUM_ITERATIONS in self._settings:
+            num_iterations = self._settings[NUM_ITERATIONS]
+        else:
+            num_iterations = 4
+
+        if RANDOM_SEED in self._settings:
+            random.seed(self._settings[RANDOM_SEED])
+
+        engine = self._settings.get(ENGINE, PYTHON_ENGINE)
+        workers = self._settings.get(WORKERS, 1)
+        frontier = self._settings.get(FRONTIER, False)
+        user_to_initial_location = None
+        if WARM_START in self._settings:
+            warm_start_dir = self._settings[WARM_START]
+            print('Loading previous location estimates from %s' % warm_start_dir)
+            user_to_initial_location = self.load_locations(warm_start_dir)
+            frontier = True
+        if engine == PYTHON_ENGINE and (workers > 1 or frontier):
+            print('Using the %s engine to run with %d workers%s'
+                        % (CSR_ENGINE, workers, ' in frontier mode' if frontier else ''))
+            engine = CSR_ENGINE
+
+        if engine not in (PYTHON_ENGINE, CSR_ENGINE):
+            raise Exception('unknown SLP engine: %s' % engine)
+
         print('Loading mention network')
-        G, vertex2user = dataset.build_graph()
-        all_users = set(G.iterNodes())
+        G = dataset.load_graph()
         print('Loaded network with %d users and %d edges'
                      % (G.numberOfNodes(), G.numberOfEdges()))
+        user_ids = dataset.vertex_user_ids()
 
-        # This dict will contain a mapping from each user ID associated with at
-        # least 5 posts within a 15km radius to the user's home location
+        # The home locations of each user associated with at least 5 posts
+        # within a 15km radius. Users are referred to by their row in home,
+        # which is their vertex descriptor if they are in the graph, and only
+        # turned back into user IDs when the model is saved.
         print('Loading known user locations')
-        user_to_home_loc = {user: loc for (user, loc) in dataset.user_home_location_iter()}
-
+        home = dataset.home_locations(user_ids)
+        num_vertices = len(user_ids)
         print('Loaded gold-standard locations of %s users (%s)'
-                     % (len(user_to_home_loc),
-                        float(len(user_to_home_loc)) / len(all_users)))
+                     % (len(home.order), float(len(home.order)) / num_vertices))
+        row_to_home_loc = {row: (lat, lon) for row, lat, lon
+                           in zip(home.order.tolist(), home.lat[home.order].tolist(),
+                                  home.lon[home.order].tolist())}
+
+        if engine == CSR_ENGINE:
+            initial = None
+            touched = None
+            if user_to_initial_location is not None:
+                initial = vertex_locations(user_to_initial_location, user_ids)
+                touched_user_ids = dataset.touched_user_ids()
+                if touched_user_ids is None:
+                    print('The dataset does not record the users touched by an update, '
+                          'so every user is recomputed in the first iteration')
+                else:
+                    touched = find_vertices(user_ids, touched_user_ids)
+                    touched = touched[touched >= 0]
+
+            located, lat, lon = propagate_csr(G, home.lat[:num_vertices], home.lon[:num_vertices],
+                                              home.has_location[:num_vertices],
+                                              num_iterations, self._median,
+                                              workers, frontier, initial, touched)
+
+            # The gold-standard users come first, followed by the other users
+            # in the order they were located
+            row_to_estimated_location = dict(row_to_home_loc)
+            row_to_estimated_location.update(zip(located.tolist(),
+                                                 zip(lat[located].tolist(), lon[located].tolist())))
+            return self.save_model(user_locations(row_user_ids(user_ids, home),
+                                                  row_to_estimated_location), model_dir)
+
+        all_users = set(G.iterNodes())
 
         # This dictionary is where we currently think a user is.  The subset of
         # users with known GPS-based home locations will always have their
         # gold-standard location set in this dict (i.e., it's not an estimate)
-        user_to_estimated_location = {}
+        row_to_estimated_location = {}
 
         # Update the initial data with the gold standard data
-        user_to_estimated_location.update(user_to_home_loc)
+        row_to_estimated_location.update(row_to_home_loc)
 
         # This dictionary is the next prediction of where we think a user is
         # based on its neighbors.  This dict is separate from the current
         # estiamte to avoid mixing the two estimates during inference time.
-        user_to_next_estimated_location = {}
-
-        # TODO: make this configurable from the settings varaible
-        if NUM_ITERATIONS in self._settings:
-            num_iterations = self._settings[NUM_ITERATIONS]
-        else:
-            num_iterations = 4
+        row_to_next_estimated_location = {}
 
         num_users = len(all_users)
 
         for iteration in range(0, num_iterations):
             print('Beginning iteration %s' % iteration)
-            num_located_at_start = len(user_to_estimated_location)
+            num_located_at_start = len(row_to_estimated_location)
             num_processed = 0
             for vertex in all_users:
-                user_to_next_estimated_location = self.update_user_location(vertex, G,
-                                          vertex2user,
-                                          user_to_home_loc,
-                                          user_to_estimated_location,
-                                          user_to_next_estimated_location)
+                row_to_next_estimated_location = self.update_user_location(vertex, G,
+                                          row_to_home_loc,
+                                          row_to_estimated_location,
+                                          row_to_next_estimated_location)
                 num_processed += 1
                 if num_processed % 10000 == 0:
                     print('In iteration %d, processed %d users out of %d, located %d'
-                                 % (iteration, num_processed, num_users, len(user_to_next_estimated_location)))
-            num_located_at_end = len(user_to_next_estimated_location)
+                                 % (iteration, num_processed, num_users, len(row_to_next_estimated_location)))
+            num_located_at_end = len(row_to_next_estimated_location)
             print('At end of iteration %s, located %s users (%s new)' %
                          (iteration, num_located_at_end,
                           num_located_at_end - num_located_at_start))
 
             # Replace all the old location estimates with what we estimated
             # from this iteration
-            user_to_estimated_location.update(user_to_next_estimated_location)
+            row_to_estimated_location.update(row_to_next_estimated_location)
+
+        return self.save_model(user_locations(row_user_ids(user_ids, home),
+                                              row_to_estimated_location), model_dir)
 
+    def save_model(self, user_to_estimated_location, model_dir):
+        """
+        Writes the user-id to location mapping to user-id-to-location.tsv in
+        model_dir, unless model_dir is None, and returns the trained model.
+        """
         print("Saving model (%s locations) to %s"
                     % (len(user_to_estimated_location), model_dir))
 
@@ -170,25 +256,23 @@ class SpatialLabelPropagation:
         return SpatialLabelPropagationModel(user_to_estimated_location)
 
 
-    def update_user_location(self, vertex, G, vertex2user,
-                             user_to_home_loc, user_to_estimated_location,
-                             user_to_next_estimated_location):
+    def update_user_location(self, vertex, G, row_to_home_loc,
+                             row_to_estimated_location,
+                             row_to_next_estimated_location):
         """
         Uses the provided social network and estimated user locations to update
-        the location of the specified user_id in the
-        user_to_next_estimated_location dict.  Users who have a home location
+        the location of the specified vertex in the
+        row_to_next_estimated_location dict.  Users who have a home location
         (defined from GPS data) will always be updated with their home location.
 
-        vertex2user: the list of userIDs, the index of a user is its vertex descriptor
-                     in the graph
+        The dicts are keyed by the rows of the dataset's home locations, which
+        are the vertex descriptors for the users in the graph.
         """
-        user_id = vertex2user[vertex]
-
         # Short-circuit if we already know where this user is located
         # so that we always preserve the "hint" going forward
-        if user_id in user_to_home_loc:
-            user_to_next_estimated_location[user_id] = user_to_home_loc[user_id]
-            return user_to_next_estimated_location
+        if vertex in row_to_home_loc:
+            row_to_next_estimated_location[vertex] = row_to_home_loc[vertex]
+            return row_to_next_estimated_location
 
         # For each of the users in the user's ego network, get their estimated
         # location, if any
@@ -196,9 +280,8 @@ class SpatialLabelPropagation:
         # NOTE: this gets all OUTGOING neighbors. This is fine for graphs where all
         # edges are bidirectional
         for neighbor_vertex in G.iterNeighbors(vertex):
-            neighbor_id = vertex2user[neighbor_vertex]
-            if neighbor_id in user_to_estimated_location:
-                locations.append(user_to_estimated_location[neighbor_id])
+            if neighbor_vertex in row_to_estimated_location:
+                locations.append(row_to_estimated_location[neighbor_vertex])
 
 
         # If we have at least one location from the neighbors, use the
@@ -209,25 +292,34 @@ class SpatialLabelPropagation:
             # For example, the social density method that Derek
             # suggested would replace the geometric median here as how
             # we estimate a user's location from their neighbors.
-            median = get_geometric_median(locations)
-            user_to_next_estimated_location[user_id] = median
+            median = self._median(locations)
+            row_to_next_estimated_location[vertex] = median
 
-        return user_to_next_estimated_location
+        return row_to_next_estimated_location
+
+    def load_locations(self, model_dir):
+        """
+        Reads the user-id to location mapping written by save_model, or the
+        gzipped user-to-lat-lon.tsv.gz of a model directory without one.
+        """
+        user_id_to_location = {}
+        path = os.path.join(model_dir, 'user-id-to-location.tsv')
+        if os.path.exists(path):
+            fh = open(path, 'r')
+        else:
+            fh = gzip.open(os.path.join(model_dir, "user-to-lat-lon.tsv.gz"), 'rt')
+        with fh:
+            for line in fh:
+                cols = line.rstrip('\n').split('\t')
+                user_id_to_location[int(cols[0])] = (float(cols[1]), float(cols[2]))
+        return user_id_to_location
 
     def load_model(self, model_dir, settings):
         """
         Reads in the user-id to location mapping from a file as the trained
         model.
         """
-        user_id_to_location = {}
-
-        model_file = gzip.open(os.path.join(model_dir, "user-to-lat-lon.tsv.gz"), 'r')
-        for line in model_file:
-            cols = line.split("\t")
-            user_id = cols[0]
-            lat = cols[1]
-            lon = cols[2]
-            user_id_to_location[user_id] = (float(lat), float(lon))
+        user_id_to_location = self.load_locations(model_dir)
         print('NUM USERS: %d' % len(user_id_to_location))
         return SpatialLabelPropagationModel(user_id_to_location)
 
@@ -244,11 +336,15 @@ def get_user_location(user):
     # This method returns null if no location was found
     return user_id, get_home_location(posts)
 
-def get_home_location(posts):
+def get_home_location(posts, median=None):
     """
     Returns the estimated home location of this user from their GPS-tagged
-    posts, or None if the user could not be associated with any location
+    posts as a (lat, lon) tuple, or None if the user could not be associated
+    with any location. The home location is median(locations) (see
+    get_median_function), by default get_geometric_median.
     """
+    if median is None:
+        median = get_geometric_median
 
     # The list of observed GPS locations for this user
     locations = []
@@ -270,10 +366,12 @@ def get_home_location(posts):
             continue
         if not coord_type == "Point":
             continue
+        # GeoJSON points are stored as [lon, lat]
         coord_arr = coords["coordinates"]
-        lat = coord_arr[0]
-        lon = coord_arr[1]
-        locations.append(Point(lat, lon))
+        lon = coord_arr[0]
+        lat = coord_arr[1]
+        # (lat, lon) tuples, which both geopy and the NumPy medians accept
+        locations.append((lat, lon))
 
         # We need at least 5 GPS tweets to infer a reliable home location
     if len(locations) < 5:
@@ -282,7 +380,7 @@ def get_home_location(posts):
     # See if we can find at least 5 tweets within 15km of each other
     if has_home(locations):
         # Return the center as a proxy for this user's home location
-        return get_geometric_median(locations)
+        return median(locations)
     else:
         # Return that the user has no home location
         return None
@@ -292,6 +390,15 @@ def has_home(locations):
     Returns True if the locations contain a subset of at least five points
     that are all within 15km of each other
     """
+    return has_close_group([loc[0] for loc in locations], [loc[1] for loc in locations], 5, 15,
+                           lambda i, j: get_distance(locations[i], locations[j]))
+
+def has_home_exhaustive(locations):
+    """
+    Answers the same question as has_home by trying every subset of
+    locations, the original implementation, kept as a reference to check
+    has_home against (see check_has_home.py)
+    """
 
     n = len(locations)
     cur_locs = []
@@ -361,7 +468,7 @@ def get_geometric_median(coordinates):
     elif n == 2:
         return coordinates[random.randint(0, 1)]
 
-    min_distance_sum = 10000000
+    min_distance_sum = float('inf')
     median = None # Point type
 
     # Loop through all the points, finding the point that minimizes the
@@ -391,6 +498,19 @@ def get_geometric_median(coordinates):
     return median
 
 
+def get_median_function(name):
+    """
+    Returns the function used to combine the locations of a user's neighbors,
+    given the value of the median setting.
+    """
+    median_functions = {GEOPY_MEDIAN: get_geometric_median,
+                        MEDOID_MEDIAN: get_medoid,
+                        WEISZFELD_MEDIAN: get_weiszfeld_median}
+    if name not in median_functions:
+        raise Exception('unknown median: %s' % name)
+    return median_functions[name]
+
+
 def get_distance(p1, p2):
     """
     Computes the distance between the two latitude-longitude Points using
@@ -0,0 +1,187 @@
+# Reads tweet files of one JSON object per line (.jsonl, or gzipped .jsonl.gz),
+# optionally keeping only some of the fields of each tweet.
+#
+# Used by the extraction scripts instead of a readline() + json.loads loop:
+#
+#     from tweet_reader import read_tweets
+#     for d in read_tweets(fpath, fields=["id", "user.id", "entities.user_mentions.id_str"]):
+#         ...
+#
+# The file is read in large chunks and each line is parsed with the fastest JSON
+# library available: orjson or simdjson if installed (pip3 install orjson),
+# the json module otherwise.
+#
+# Scripts that only keep a few tweets can skip parsing the others with a
+# line_filter, a function that gets the raw bytes of each line and returns False
+# for the lines that cannot match, e.g., IDLineFilter.
+#
+# Scripts outside of this folder add it to their path to import this module.
+
+import gzip
+import json
+import re
+
+# The number of bytes read from a file at a time
+CHUNK_SIZE = 16 * 2 ** 20
+
+# The JSON backends, in order of preference
+BACKENDS = ["orjson", "simdjson", "json"]
+
+# Matches the value of any "id" or "id_str" field in a raw tweet line
+ID_FIELD = re.compile(rb'"id(?:_str)?"\s*:\s*"?(\d+)')
+
+
+def get_loads(backend=None):
+    """
+    Returns the function parsing a JSON document from bytes of the given
+    backend ("orjson", "simdjson" or "json"), or of the first available one
+    in BACKENDS if backend is None.
+    """
+    for name in ([backend] if backend else BACKENDS):
+        if name == "orjson":
+            try:
+                import orjson
+                return orjson.loads
+            except ImportError:
+                pass
+        elif name == "simdjson":
+            try:
+                import simdjson
+                return simdjson.loads
+            except ImportError:
+                pass
+        elif name == "json":
+            return json.loads
+        else:
+            raise Exception("Unknown JSON backend: {}".format(name))
+    raise Exception("The JSON backend {} is not installed".format(backend))
+
+
+def open_tweet_file(fpath):
+    """
+    Opens a .jsonl or gzipped .jsonl.gz file for reading bytes.
+    """
+    if fpath.endswith(".gz"):
+        return gzip.open(fpath, "rb")
+    return open(fpath, "rb")
+
+
+def read_lines(fpath, chunk_size=CHUNK_SIZE):
+    """
+    Yields the non-empty lines of a tweet file as bytes, without the line
+    break, reading chunk_size bytes at a time.
+    """
+    with open_tweet_file(fpath) as f:
+        rest = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def index_json(idx_string, obj):
+    """
+    Indexes into a json object using a string index containing dots, as
+    index_json in spatial_label_propagation/slp/build_dataset.py does: a list
+    is indexed by indexing each of its items. Unlike that function, a missing
+    key or a null value gives None instead of an error.
+        e.g.)
+            [user["id"] for user in post["entities"]["user_mentions"]]
+            is equivalent to
+            index_json("entities.user_mentions.id", post)
+    """
+    return _index(idx_string.split("."), obj)
+
+
+def _index(indices, obj):
+    for i, idx in enumerate(indices):
+        if obj is None:
+            return None
+        if type(obj) == list:
+            return [_index(indices[i:], sub_obj) for sub_obj in obj]
+        obj = obj.get(idx)
+    return obj
+
+
+class IDLineFilter:
+    """
+    A line filter that is True for the raw lines with an "id" or "id_str"
+    field (at any depth, e.g., user.id or entities.user_mentions.id_str)
+    whose value is one of the given user IDs. A tweet by or mentioning one of
+    these users always passes the filter; other tweets pass if, e.g., their
+    own ID is in ids. It counts the lines it sees and keeps.
+    """
+    def __init__(self, ids):
+        self.id_bytes = set(str(i).encode() for i in ids)
+        self.num_lines = 0
+        self.num_kept = 0
+
+    def __call__(self, line):
+        self.num_lines += 1
+        if self.id_bytes.isdisjoint(ID_FIELD.findall(line)):
+            return False
+        self.num_kept += 1
+        return True
+
+
+def check_line_filter(fpath, line_filter, is_match, backend=None):
+    """
+    Parses every line of a tweet file to check that line_filter keeps all
+    the tweets for which is_match is True.
+
+    Returns:
+        (num_tweets, num_kept, num_matched, num_missed): the number of
+        tweets, of tweets kept by the filter, of tweets matching and of
+        matching tweets the filter drops, which must be 0
+    """
+    loads = get_loads(backend)
+    num_tweets = num_kept = num_matched = num_missed = 0
+    for line in read_lines(fpath):
+        kept = line_filter(line)
+        matched = is_match(loads(line))
+        num_tweets += 1
+        num_kept += kept
+        num_matched += matched
+        num_missed += matched and not kept
+    return num_tweets, num_kept, num_matched, num_missed
+
+
+def read_tweets(fpath, fields=None, backend=None, chunk_size=CHUNK_SIZE, line_filter=None):
+    """
+    Yields the tweets of a .jsonl or .jsonl.gz file, in order.
+
+    Arguments:
+        fpath: path to the tweet file
+        fields: a list of dotted field names (see index_json) to keep, or None
+                to keep whole tweets. Each tweet is then a dict mapping each
+                field name to its value, so that a list of top-level fields
+                such as ["id", "user", "place"] gives a tweet with only those
+                fields (None if missing).
+        backend: the JSON backend to use, see get_loads
+        chunk_size: the number of bytes read at a time
+        line_filter: if given, only the lines for which line_filter(line) is
+                     True are parsed, see IDLineFilter
+
+    Returns:
+        a generator of tweet dicts
+    """
+    loads = get_loads(backend)
+    lines = read_lines(fpath, chunk_size)
+    if line_filter is not None:
+        lines = filter(line_filter, lines)
+    if fields is None:
+        for line in lines:
+            yield loads(line)
+        return
+
+    paths = [(field, field.split(".")) for field in fields]
+    for line in lines:
+        d = loads(line)
+        yield {field: _index(indices, d) for field, indices in paths}
@@ -3,6 +3,9 @@
 
 import csv,  os, sys, random, json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "canadian_user_identification"))
+from tweet_reader import read_tweets
+
 
 R1, R2, R3, R4 = "1", "2", "3", "4"
 
@@ -18,48 +21,38 @@ def extract_tweets(fpath):
     criteria = {"mask", "#mask", "#masks", "#wearamask", "masks", "wear", "mask-wearing"}
     phrase_criteria = {"face covering", "face-mask", "mask wearing"}
 
-    with open(fpath, "r") as json_file:
-        line = json_file.readline()
-        i = 0
+    for d in read_tweets(fpath, fields=["id", "full_text", "retweeted_status"]):
+        tweetID = d["id"]
+        text = d["full_text"]
 
-        while line:
-            d = json.loads(line)
-            tweetID = d["id"]
-            text = d["full_text"]
-            
-            # ignore retweets, look only at original content
-            if "retweeted_status" in d:
-                # read the next line
-                line = json_file.readline()
-                continue
-
-
-            # check if this tweet satisfies the criteria
-            satisfying = False
-            for c in criteria:
-                # check for masks, mask, or wear
-                if c in text.lower().split():
-                    satisfying = True
-                    break
-            
-            for p in phrase_criteria:
-                # for these, just do a simple pattern match
-                if p in text.lower():
-                    satisfying = True
-                    break
-            
-            # try to sample longer tweets, avoid wasting manual labour classifying
-            # a tweet that is just an emoji and a link
-            if len(text.lower().split()) >= 5:
-                if satisfying:
-                    mask[tweetID] = text
-                general[tweetID] = text
-            
-            # read the next line
-            line = json_file.readline()
+        # ignore retweets, look only at original content
+        if d["retweeted_status"] is not None:
+            continue
+
+
+        # check if this tweet satisfies the criteria
+        satisfying = False
+        for c in criteria:
+            # check for masks, mask, or wear
+            if c in text.lower().split():
+                satisfying = True
+                break
+        
+        for p in phrase_criteria:
+            # for these, just do a simple pattern match
+            if p in text.lower():
+                satisfying = True
+                break
         
-        # print an update of the size of the dictionaries
-        return mask, general
+        # try to sample longer tweets, avoid wasting manual labour classifying
+        # a tweet that is just an emoji and a link
+        if len(text.lower().split()) >= 5:
+            if satisfying:
+                mask[tweetID] = text
+            general[tweetID] = text
+
+    # print an update of the size of the dictionaries
+    return mask, general
 
 
 if __name__ == "__main__":